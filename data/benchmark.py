@@ -0,0 +1,324 @@
+# Correctness and throughput benchmark for the Othello board engines
+# every engine is checked move by move against ReferenceBoard, a frozen copy of the original direction
+# walking OthelloBoardState, on the same fixed-seed games, perft node counts are checked against known
+# values, and the timings are written as JSON to compare across runs (the exit status is 1 on any
+# mismatch or, with --compare, any timing slower than the tolerance):
+#   python -m data.benchmark --out bench.json
+#   python -m data.benchmark --out bench_new.json --compare bench.json
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import numpy as np
+import torch
+
+from .othello import OthelloBoardState, OthelloBitBoardState, BatchedOthelloBoards, get_ood_game, \
+    generate_random_games, validate_games, zobrist_hash, canonical_zobrist, zobrist_white_to_move, eights, gt_dtypes
+from .othello_torch import replay_games
+
+engines = {
+    "OthelloBoardState": OthelloBoardState,
+    "OthelloBitBoardState": OthelloBitBoardState,
+}
+# leaf counts from the starting position by depth, forfeits are not plies (as in umpire)
+perft_reference = [1, 4, 12, 56, 244, 1396, 8200, 55092, 390216]
+getters = ["get_state", "get_age", "get_occupied", "get_valid_moves", "get_next_hand_color"]
+
+class ReferenceBoard():
+    # the original OthelloBoardState move logic, kept as is as the oracle of the checks: do not optimize
+    def __init__(self, ):
+        board = np.zeros((8, 8))
+        board[3, 4] = 1
+        board[3, 3] = -1
+        board[4, 3] = 1
+        board[4, 4] = -1
+        self.state = board
+        self.age = np.zeros((8, 8))
+        self.next_hand_color = 1
+        self.history = []
+
+    def get_occupied(self, ):
+        board = self.state
+        tbr = board.flatten() != 0
+        return tbr.tolist()
+    def get_state(self, ):
+        board = self.state + 1  # white 0, blank 1, black 2
+        tbr = board.flatten()
+        return tbr.tolist()
+    def get_age(self, ):
+        return self.age.flatten().tolist()
+    def get_next_hand_color(self, ):
+        return (self.next_hand_color + 1) // 2
+
+    def flips(self, r, c, color):
+        tbf = []
+        for direction in eights:
+            buffer = []
+            cur_r, cur_c = r, c
+            while 1:
+                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
+                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
+                    break
+                if self.state[cur_r, cur_c] == 0:
+                    break
+                elif self.state[cur_r, cur_c] == color:
+                    tbf.extend(buffer)
+                    break
+                else:
+                    buffer.append([cur_r, cur_c])
+        return tbf
+
+    def umpire(self, move):
+        r, c = move // 8, move % 8
+        assert self.state[r, c] == 0, f"{r}-{c} is already occupied!"
+        color = self.next_hand_color
+        tbf = self.flips(r, c, color)
+        if len(tbf) == 0:  # means one hand is forfeited
+            color *= -1
+            self.next_hand_color *= -1
+            tbf = self.flips(r, c, color)
+        assert len(tbf), "Illegal move!"
+        self.age += 1
+        for ff in tbf:
+            self.state[ff[0], ff[1]] *= -1
+            self.age[ff[0], ff[1]] = 0
+        self.state[r, c] = color
+        self.age[r, c] = 0
+        self.next_hand_color *= -1
+        self.history.append(move)
+
+    def tentative_move(self, move):
+        r, c = move // 8, move % 8
+        if not self.state[r, c] == 0:
+            return 0
+        if len(self.flips(r, c, self.next_hand_color)):
+            return 1
+        if len(self.flips(r, c, -self.next_hand_color)):
+            return 2
+        return 0
+
+    def get_valid_moves(self, ):
+        regular_moves = []
+        forfeit_moves = []
+        for move in range(64):
+            x = self.tentative_move(move)
+            if x == 1:
+                regular_moves.append(move)
+            elif x == 2:
+                forfeit_moves.append(move)
+        if len(regular_moves):
+            return regular_moves
+        elif len(forfeit_moves):
+            return forfeit_moves
+        else:
+            return []
+
+def reference_gt(game):
+    # what get_gt_multi should return for game, from ReferenceBoard
+    T = len(game)
+    tbr = {f: np.zeros((T, ) if f == "next_hand_color" else (T, 64), dtype=gt_dtypes[f]) for f in gt_dtypes}
+    board = ReferenceBoard()
+    for t, move in enumerate(game):
+        before = board.state.reshape(-1).copy()
+        board.umpire(move)
+        after = board.state.reshape(-1)
+        tbr["state"][t] = board.get_state()
+        tbr["age"][t] = board.get_age()
+        tbr["occupied"][t] = board.get_occupied()
+        tbr["legal"][t, board.get_valid_moves()] = True
+        tbr["flipped"][t] = (before != 0) & (before != after)
+        tbr["next_hand_color"][t] = board.get_next_hand_color()
+    return tbr
+
+def perft(board, depth):
+    # number of positions depth moves away, games that end earlier do not count
+    if depth == 0:
+        return 1
+    tbr = 0
+    for move in board.get_valid_moves():
+        board.make_move(move)
+        tbr += perft(board, depth - 1)
+        board.unmake_move()
+    return tbr
+
+def random_games(num_games, seed):
+    # uniformly random legal games, played with the reference engine from a fixed seed
+    rng = random.Random(seed)
+    games = []
+    for _ in range(num_games):
+        board = ReferenceBoard()
+        game = []
+        valids = board.get_valid_moves()
+        while valids:
+            game.append(rng.choice(valids))
+            board.umpire(game[-1])
+            valids = board.get_valid_moves()
+        games.append(game)
+    return games
+
+def pad_games(games):
+    tbr = np.full((len(games), 60), -100, dtype=np.int64)
+    for i, game in enumerate(games):
+        tbr[i, :len(game)] = game
+    return tbr
+
+def position_keys(board):
+    # (position_key, canonical_position_key) computed from the state alone, what every engine should return
+    cells = [int(_) for _ in np.asarray(board.state).reshape(-1).tolist()]
+    key = zobrist_hash(cells) ^ (zobrist_white_to_move if board.next_hand_color == -1 else 0)
+    return key, canonical_zobrist(cells, board.next_hand_color)
+
+def check_engine(engine, games):
+    # number of games where engine disagrees with ReferenceBoard on any getter, tentative_move, the
+    # position keys or get_gt_multi
+    mismatches = 0
+    for game in games:
+        gt, multi = reference_gt(game), engine().get_gt_multi(game)
+        if any((gt[f] != multi[f]).any() for f in gt):
+            mismatches += 1
+            continue
+        ref, board = ReferenceBoard(), engine()
+        for move in game:
+            ref.umpire(move)
+            board.umpire(move)
+            if any(getattr(ref, g)() != getattr(board, g)() for g in getters) or \
+                    any(ref.tentative_move(sq) != board.tentative_move(sq) for sq in range(64)) or \
+                    position_keys(ref) != (board.position_key(), board.canonical_position_key()):
+                mismatches += 1
+                break
+    return mismatches
+
+def check_batched(games):
+    # number of games where BatchedOthelloBoards or the torch replay disagree with ReferenceBoard
+    moves = pad_games(games)
+    legal, flipped, state, age, next_hand_color = BatchedOthelloBoards(len(games)).replay(moves)
+    t_state, t_legal, t_flipped = [_.numpy() for _ in replay_games(torch.tensor(moves))]
+    mismatches = {"BatchedOthelloBoards": 0, "replay_games": 0}
+    for i, game in enumerate(games):
+        gt = reference_gt(game)
+        T = len(game)
+        if not ((legal[i, :T] == gt["legal"]).all() and (flipped[i, :T] == gt["flipped"]).all() and
+                (state[i, :T] == gt["state"]).all() and (age[i, :T] == gt["age"]).all() and
+                (next_hand_color[i, :T] == gt["next_hand_color"]).all()):
+            mismatches["BatchedOthelloBoards"] += 1
+        if not ((t_legal[i, :T] == gt["legal"]).all() and (t_flipped[i, :T] == gt["flipped"]).all() and
+                (t_state[i, :T].reshape(T, 64) + 1 == gt["state"]).all()):
+            mismatches["replay_games"] += 1
+    return mismatches
+
+def timed(fn):
+    t_start = time.perf_counter()
+    fn()
+    return time.perf_counter() - t_start
+
+def time_engine(engine, games):
+    def replay():
+        for game in games:
+            board = engine()
+            for move in game:
+                board.umpire(move)
+    # get_valid_moves is timed on its own, once on a copy of every position of the games taken beforehand,
+    # right after its move as in get_gt (the lazy bookkeeping of OthelloBoardState is settled up to it)
+    positions = []
+    for game in games:
+        board = engine()
+        for move in game:
+            board.umpire(move)
+            positions.append(board.clone())
+            board.get_valid_moves()
+    return {
+        "umpire": timed(replay),
+        "get_valid_moves": timed(lambda: [board.get_valid_moves() for board in positions]),
+        "get_gt": timed(lambda: [engine().get_gt(game, "get_state") for game in games]),
+        "get_gt_multi": timed(lambda: [engine().get_gt_multi(game) for game in games]),
+    }
+
+def run(depth, num_games, seed):
+    games = random_games(num_games, seed)
+    res = {
+        "meta": {
+            "time": time.strftime("%Y%m%d_%H%M%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "torch": torch.__version__, "machine": platform.machine(),
+            "depth": depth, "games": num_games, "seed": seed, "plies": sum(len(_) for _ in games),
+        },
+        "perft": {}, "mismatches": {}, "seconds": {},
+    }
+    for name, engine in engines.items():
+        res["perft"][name] = []
+        for d in range(depth + 1):
+            t_start = time.perf_counter()
+            nodes = perft(engine(), d)
+            res["perft"][name].append({"depth": d, "nodes": nodes, "seconds": time.perf_counter() - t_start})
+        res["mismatches"][name] = check_engine(engine, games)
+        for k, v in time_engine(engine, games).items():
+            res["seconds"][f"{name}.{k}"] = v
+    res["mismatches"].update(check_batched(games))
+    # the uint8 games of the lockstep generator, padded with move_pad, should all be legal
+    first_illegal, _ = validate_games(generate_random_games(num_games, seed=seed))
+    res["illegal"] = {"generate_random_games": int((first_illegal >= 0).sum())}
+    moves = pad_games(games)
+    res["seconds"]["BatchedOthelloBoards.replay"] = timed(lambda: BatchedOthelloBoards(len(games)).replay(moves))
+    res["seconds"]["replay_games"] = timed(lambda: replay_games(torch.tensor(moves)))
+    random.seed(seed)
+    res["seconds"]["get_ood_game"] = timed(lambda: [get_ood_game(_) for _ in range(num_games)])
+    return res
+
+def failures(res):
+    # human readable list of correctness problems in a result
+    tbr = []
+    for name, counts in res["perft"].items():
+        for row in counts:
+            if row["depth"] < len(perft_reference) and row["nodes"] != perft_reference[row["depth"]]:
+                tbr.append(f"{name} perft({row['depth']}) = {row['nodes']}, expected {perft_reference[row['depth']]}")
+    for name, count in res["mismatches"].items():
+        if count:
+            tbr.append(f"{name} disagrees with ReferenceBoard on {count}/{res['meta']['games']} games")
+    for name, count in res.get("illegal", {}).items():
+        if count:
+            tbr.append(f"validate_games finds {count}/{res['meta']['games']} games of {name} illegal")
+    return tbr
+
+def compare(res, old, tolerance):
+    # print timings side by side, returns the keys that got slower by more than tolerance
+    slower = []
+    print(f"{'':40s} {'old':>10s} {'new':>10s} {'ratio':>7s}")
+    for k, v in res["seconds"].items():
+        if k not in old["seconds"]:
+            print(f"{k:40s} {'-':>10s} {v:10.4f}")
+            continue
+        ratio = v / max(old["seconds"][k], 1e-9)
+        print(f"{k:40s} {old['seconds'][k]:10.4f} {v:10.4f} {ratio:7.2f}")
+        if ratio > 1 + tolerance:
+            slower.append(k)
+    return slower
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check and time the Othello board engines')
+    parser.add_argument('--depth', default=6, type=int)
+    parser.add_argument('--games', default=200, type=int)
+    parser.add_argument('--seed', default=42, type=int)
+    parser.add_argument('--out', default=None, type=str)
+    parser.add_argument('--compare', default=None, type=str)
+    parser.add_argument('--tolerance', default=0.2, type=float)
+    args = parser.parse_args()
+
+    res = run(args.depth, args.games, args.seed)
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(res, f, indent=2)
+    problems = failures(res)
+    for p in problems:
+        print(p)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        slower = compare(res, old, args.tolerance)
+        if slower:
+            print(f"Slower than {args.compare} by more than {args.tolerance:.0%}: {', '.join(slower)}")
+            problems.extend(slower)
+    else:
+        for k, v in res["seconds"].items():
+            print(f"{k:40s} {v:10.4f}")
+    sys.exit(1 if problems else 0)
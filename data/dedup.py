@@ -0,0 +1,164 @@
+# Out-of-core deduplication of game corpora too large to hold in memory, into a packed store
+#   python -m data.dedup --inputs ./data/othello_synthetic --out ./data/othello_synthetic/packed --tmp /scratch/dedup
+# inputs are pickled shards, directories of them, or packed stores, each pickle or store counting as one shard;
+# the result holds every distinct game once, sorted as load_shards and data.store sort them so Othello
+# takes the same train/val split from it, and its manifest counts the duplicates every shard contributed
+# (the first occurrence in input order being the original)
+# memory stays bounded by one chunk of games, one hash bucket, one opening bucket and a byte per game:
+#   1. games are streamed in chunks into one spill file of packed rows, and (hash, position) pairs
+#      are partitioned by the top bits of the hash into bucket spill files
+#   2. each bucket is sorted by hash, rows of equal hashes are compared byte by byte, and every
+#      later copy is marked in a keep mask
+#   3. the spill file is streamed again through the mask into one spill file per opening (the first
+#      opening_len moves), then the openings are sorted one at a time and written to the store in order
+import os
+import time
+import shutil
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+from .othello import load_store, load_shard, hash_games, move_pad, write_manifest, sort_games
+
+pair = np.dtype([("hash", "<u8"), ("order", "<u8")])
+opening_len = 4  # 244 openings of 4 moves, so every opening bucket holds a small share of the games
+
+def expand_inputs(inputs):
+    # every pickle or store, directories of pickles expanded in name order
+    tbr = []
+    for path in inputs:
+        if os.path.isdir(path) and not os.path.exists(os.path.join(path, "manifest.json")):
+            tbr.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".pickle"))
+        else:
+            tbr.append(path)
+    return tbr
+
+def read_chunks(path, chunk_size):
+    # [n, 60] uint8 blocks of a shard, a store is read chunk by chunk, a pickle at once
+    if path.endswith(".pickle"):
+        yield load_shard((path, 0))
+        return
+    moves = load_store(path).moves
+    for start in range(0, len(moves), chunk_size):
+        yield np.asarray(moves[start:start + chunk_size])
+
+def spill(shards, tmp, num_buckets, chunk_size):
+    # step 1, returns the number of games of every shard
+    bits = int(np.log2(num_buckets))
+    assert 2 ** bits == num_buckets, "num_buckets should be a power of 2"
+    buckets = [open(os.path.join(tmp, f"bucket_{b:05d}.bin"), "wb") for b in range(num_buckets)]
+    counts = []
+    order = 0
+    with open(os.path.join(tmp, "games.bin"), "wb") as games:
+        for path in tqdm(shards, desc="Spilling"):
+            count = 0
+            for moves in read_chunks(path, chunk_size):
+                moves.tofile(games)
+                pairs = np.empty(len(moves), dtype=pair)
+                pairs["hash"] = hash_games(moves)
+                pairs["order"] = np.arange(order, order + len(moves), dtype=np.uint64)
+                bucket = (pairs["hash"] >> np.uint64(64 - bits)).astype(np.int64) if bits else np.zeros(len(moves), dtype=np.int64)
+                pairs = pairs[np.argsort(bucket, kind="stable")]
+                bounds = np.searchsorted(np.sort(bucket), np.arange(num_buckets + 1))
+                for b in range(num_buckets):
+                    if bounds[b + 1] > bounds[b]:
+                        pairs[bounds[b]:bounds[b + 1]].tofile(buckets[b])
+                order += len(moves)
+                count += len(moves)
+            counts.append(count)
+    for f in buckets:
+        f.close()
+    return counts
+
+def mark_duplicates(tmp, num_buckets, total):
+    # step 2, keep mask [total, ] bool of the first occurrence of every game
+    games = np.memmap(os.path.join(tmp, "games.bin"), dtype=np.uint8, mode="r", shape=(total, 60)) if total else None
+    keep = np.ones(total, dtype=bool)
+    for b in tqdm(range(num_buckets), desc="Deduplicating"):
+        path = os.path.join(tmp, f"bucket_{b:05d}.bin")
+        pairs = np.fromfile(path, dtype=pair)
+        os.remove(path)
+        pairs = pairs[np.lexsort((pairs["order"], pairs["hash"]))]
+        same = pairs["hash"][1:] == pairs["hash"][:-1]
+        # every pair sharing its hash with another one, only those rows need comparing
+        shared = np.zeros(len(pairs), dtype=bool)
+        shared[1:] |= same
+        shared[:-1] |= same
+        if not shared.any():
+            continue
+        candidates = pairs[shared]
+        rows = np.ascontiguousarray(games[candidates["order"].astype(np.int64)])
+        keys = np.empty(len(candidates), dtype=[("hash", "<u8"), ("row", "V60")])
+        keys["hash"] = candidates["hash"]
+        keys["row"] = rows.view("V60").ravel()
+        _, first = np.unique(keys, return_index=True)  # candidates are in order within a hash, first copy wins
+        drop = np.ones(len(candidates), dtype=bool)
+        drop[first] = False
+        keep[candidates["order"][drop].astype(np.int64)] = False
+    return keep
+
+def opening_keys(moves):
+    # [n, ] uint32 whose order is the sort_games order of the first opening_len moves
+    keys = moves[:, :opening_len] + np.uint8(1)  # move_pad wraps around to 0, as in sort_games
+    return np.ascontiguousarray(keys).view(">u4").ravel()
+
+def write_kept(tmp, out, keep, chunk_size):
+    # step 3, the kept games sorted into the store at out
+    os.makedirs(out, exist_ok=True)
+    total, kept = len(keep), int(keep.sum())
+    openings = {}
+    with open(os.path.join(tmp, "games.bin"), "rb") as games:
+        for start in tqdm(range(0, total, chunk_size), desc="Splitting"):
+            moves = np.fromfile(games, dtype=np.uint8, count=min(chunk_size, total - start) * 60).reshape(-1, 60)
+            moves = moves[keep[start:start + len(moves)]]
+            keys = opening_keys(moves)
+            for key in np.unique(keys).tolist():
+                if key not in openings:
+                    openings[key] = open(os.path.join(tmp, f"opening_{key:08x}.bin"), "wb")
+                moves[keys == key].tofile(openings[key])
+    for f in openings.values():
+        f.close()
+    os.remove(os.path.join(tmp, "games.bin"))
+    lengths = np.lib.format.open_memmap(os.path.join(out, "lengths.npy"), mode="w+", dtype=np.uint8, shape=(kept, ))
+    written = 0
+    with open(os.path.join(out, "moves.bin"), "wb") as f:
+        for key in tqdm(sorted(openings), desc="Writing"):
+            path = os.path.join(tmp, f"opening_{key:08x}.bin")
+            moves = sort_games(np.fromfile(path, dtype=np.uint8).reshape(-1, 60))
+            os.remove(path)
+            moves.tofile(f)
+            lengths[written:written + len(moves)] = (moves != move_pad).sum(1)
+            written += len(moves)
+    lengths.flush()
+    return kept
+
+def dedup(inputs, out, tmp, num_buckets=256, chunk_size=1000000):
+    # returns {shard: number of its games that repeat an earlier game}
+    shards = expand_inputs(inputs)
+    os.makedirs(tmp, exist_ok=True)
+    counts = spill(shards, tmp, num_buckets, chunk_size)
+    keep = mark_duplicates(tmp, num_buckets, sum(counts))
+    kept = write_kept(tmp, out, keep, chunk_size)
+    bounds = np.cumsum([0] + counts)
+    duplicates = {os.path.basename(s.rstrip("/")): int(len(keep[bounds[i]:bounds[i + 1]]) - keep[bounds[i]:bounds[i + 1]].sum())
+                  for i, s in enumerate(shards)}
+    write_manifest(out, kept, sources=[os.path.basename(s.rstrip("/")) for s in shards], games_in=counts,
+                   duplicates=duplicates, created=time.strftime("%Y%m%d_%H%M%S"))
+    shutil.rmtree(tmp)
+    print(f"Kept {kept}/{sum(counts)} games from {len(shards)} shards in {out}")
+    return duplicates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Deduplicate game shards out of core into a packed store')
+    parser.add_argument('--inputs', nargs="+", required=True, type=str)
+    parser.add_argument('--out', required=True, type=str)
+    parser.add_argument('--tmp', default=None, type=str)  # spill files, up to about 136 bytes per game
+    parser.add_argument('--buckets', default=256, type=int)
+    parser.add_argument('--chunk_size', default=1000000, type=int)
+    args = parser.parse_args()
+
+    duplicates = dedup(args.inputs, args.out, args.tmp if args.tmp is not None else args.out + "_tmp",
+                       args.buckets, args.chunk_size)
+    for shard, count in duplicates.items():
+        if count:
+            print(f"{shard}: {count} duplicates")
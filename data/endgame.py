@@ -0,0 +1,292 @@
+# Exact endgame solver on the bitboards of othello.py, for perfect-play labels ("who wins from here")
+# the value of a position is the final disc differential (own - opp, empty squares left at the end are not
+# counted) when both sides play perfectly from it, forfeits handled as in umpire
+#   python -m data.endgame --data_root data/othello_championship --max_empties 14 --out endgame.npz
+# writes values [N, 60] int8, the value for black of the position right after move t (unsolved where
+# more than max_empties squares are empty or past the end of the game), and best [N, 60] uint64,
+# the bitboard of every move reaching that value, aligned with othello.sequences
+import argparse
+import multiprocessing
+import numpy as np
+from tqdm import tqdm
+
+from .othello import eights, full_board, bb_directions, bb_shift, bb_moves, bb_flips, bb_to_squares, neighbors, get
+from .search import popcount, board_to_bitboards
+
+unsolved = -128  # value of positions that were not solved in the annotation arrays
+# below this many empty squares, moves are found by trying the empty squares and ordered by parity only
+shallow_empties = 6
+# from this many empty squares on, nodes try the stability cutoff
+stability_empties = 10
+
+# neighbor_masks[sq]: squares adjacent to sq, a move needs an opponent disc there
+neighbor_masks = [sum(1 << n for n in ns) for ns in neighbors]
+# the 4 quadrants, parity ordering plays first in regions with an odd number of empty squares
+quadrant_masks = [sum(1 << (r * 8 + c) for r in rows for c in cols)
+                  for rows in (range(4), range(4, 8)) for cols in (range(4), range(4, 8))]
+quadrant_of = [(sq // 32) * 2 + (sq % 8) // 4 for sq in range(64)]
+corners = (1 << 0) | (1 << 7) | (1 << 56) | (1 << 63)
+
+def build_lines():
+    # for d in 0-3, the masks of every line of the board in direction eights[d] (and its opposite d + 4)
+    tbr = []
+    for dr, dc in eights[:4]:
+        lines = []
+        for sq in range(64):
+            r, c = sq // 8, sq % 8
+            if 0 <= r - dr < 8 and 0 <= c - dc < 8:
+                continue  # not the start of a line
+            line = 0
+            while 0 <= r < 8 and 0 <= c < 8:
+                line |= 1 << (r * 8 + c)
+                r, c = r + dr, c + dc
+            lines.append(line)
+        tbr.append(lines)
+    return tbr
+
+line_masks = build_lines()
+# back_directions[d] moves the bit of a square's neighbor in direction eights[d] onto the square
+back_directions = [bb_directions[(d + 4) % 8] for d in range(8)]
+# squares whose neighbor in direction eights[d] is off the board
+off_board = [full_board & ~bb_shift(full_board, *back_directions[d]) for d in range(8)]
+
+def stable_discs(own, opp):
+    # own discs that can never be flipped: along each of the 4 lines through them, the line is full or
+    # the neighbor on one side is off the board or a stable own disc
+    occupied = own | opp
+    full_lines = [sum(line for line in lines if occupied & line == line) for lines in line_masks]
+    stable = 0
+    while True:
+        x = own
+        for d in range(4):
+            x &= full_lines[d] | off_board[d] | off_board[d + 4] | \
+                bb_shift(stable, *back_directions[d]) | bb_shift(stable, *back_directions[d + 4])
+        if x == stable:
+            return stable
+        stable = x
+
+def final_diff(own, opp):
+    return popcount(own) - popcount(opp)
+
+class EndgameSolver():
+    # negamax with alpha-beta to the end of the game, ordered by parity and stability (and by opponent
+    # mobility far from the end), with a transposition table of value bounds kept across calls, so
+    # solving the later positions of an already solved game is mostly lookups
+    def __init__(self, tt_size=2 ** 22):
+        self.tt_size = tt_size
+        self.tt = {}
+        self.nodes = 0
+
+    def solve(self, board, best_moves=True):
+        # (value for the player to move, sorted list of every move reaching it) of any engine's board,
+        # (final disc differential for black, []) if the game is over
+        sides = board_to_bitboards(board)
+        if sides is None:
+            if hasattr(board, "black"):
+                return final_diff(board.black, board.white), []
+            cells = board.state.flatten()
+            return int((cells == 1).sum() - (cells == -1).sum()), []
+        return self.solve_bitboards(*sides, best_moves=best_moves)
+
+    def solve_bitboards(self, own, opp, best_moves=True):
+        # own is the player to move and must have a move
+        if len(self.tt) > self.tt_size:
+            self.tt = {}
+        value = self.negamax(own, opp, -65, 65)
+        tbr = []
+        for move in bb_to_squares(bb_moves(own, opp)):
+            flips = bb_flips(own, opp, move)
+            # a move reaches value iff its value is not below it, one null window search each
+            if -self.negamax(opp & ~flips, own | flips | (1 << move), -value, -value + 1) >= value:
+                tbr.append(move)
+                if not best_moves:
+                    break  # any one of them
+        return value, tbr
+
+    def value(self, own, opp):
+        # exact value for own to move, who may have to forfeit
+        return self.negamax(own, opp, -65, 65)
+
+    def negamax(self, own, opp, alpha, beta):
+        # fail-soft: the exact value if strictly between alpha and beta, else a bound on the same side
+        empty = ~(own | opp) & full_board
+        n_empty = popcount(empty)
+        if n_empty <= shallow_empties:
+            return self.shallow(own, opp, empty, n_empty, alpha, beta, False)
+        self.nodes += 1
+        key = (own, opp)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            e_lower, e_upper, tt_move = entry
+            if e_lower >= beta:
+                return e_lower
+            if e_upper <= alpha:
+                return e_upper
+            if e_lower == e_upper:
+                return e_lower
+            alpha, beta = max(alpha, e_lower), min(beta, e_upper)
+        else:
+            e_lower, e_upper = -65, 65
+        if n_empty >= stability_empties:
+            # opp keeps its stable discs, so own can not do better than this
+            bound = 64 - 2 * popcount(stable_discs(opp, own))
+            if bound <= alpha:
+                return bound
+        moves = bb_moves(own, opp)
+        if moves == 0:
+            if bb_moves(opp, own) == 0:
+                return final_diff(own, opp)
+            return -self.negamax(opp, own, -beta, -alpha)  # forfeit, not a ply
+        alpha_start = alpha
+        best_value, best = -65, None
+        for i, (move, flips) in enumerate(self.order(own, opp, empty, n_empty, moves, tt_move)):
+            new_own, new_opp = opp & ~flips, own | flips | (1 << move)
+            if i == 0:
+                value = -self.negamax(new_own, new_opp, -beta, -alpha)
+            else:
+                # principal variation search: prove the move is no better with a null window first
+                value = -self.negamax(new_own, new_opp, -alpha - 1, -alpha)
+                if alpha < value < beta:
+                    value = -self.negamax(new_own, new_opp, -beta, -value)
+            if value > best_value:
+                best_value, best = value, move
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        break
+        if best_value >= beta:
+            e_lower = best_value
+        elif best_value > alpha_start:
+            e_lower = e_upper = best_value
+        else:
+            e_upper = best_value
+        self.tt[key] = (e_lower, e_upper, best)
+        return best_value
+
+    def order(self, own, opp, empty, n_empty, moves, tt_move):
+        # (move, flips) pairs, table move first, then fewest replies for the opponent (fastest first), with
+        # bonuses for playing in an odd quadrant and for the stable discs own gets, corners far from the end
+        scored = []
+        for move in bb_to_squares(moves):
+            flips = bb_flips(own, opp, move)
+            if move == tt_move:
+                score = -1000
+            else:
+                new_own, new_opp = own | flips | (1 << move), opp & ~flips
+                score = 16 * popcount(bb_moves(new_opp, new_own))
+                score -= 4 * (popcount(empty & quadrant_masks[quadrant_of[move]]) & 1)
+                if n_empty >= stability_empties:
+                    score -= 4 * popcount(stable_discs(new_own, new_opp))
+                else:
+                    score -= 8 * (corners >> move & 1)
+            scored.append((score, move, flips))
+        scored.sort()
+        return [(move, flips) for _, move, flips in scored]
+
+    def shallow(self, own, opp, empty, n_empty, alpha, beta, passed):
+        # the last few empty squares: no table, no move generation, empty squares in odd quadrants first
+        self.nodes += 1
+        if n_empty == 1:
+            return self.last_move(own, opp, empty.bit_length() - 1)
+        squares = bb_to_squares(empty)
+        if n_empty > 3:
+            squares.sort(key=lambda sq: -(popcount(empty & quadrant_masks[quadrant_of[sq]]) & 1))
+        best_value = -65
+        for move in squares:
+            if not opp & neighbor_masks[move]:
+                continue
+            flips = bb_flips(own, opp, move)
+            if not flips:
+                continue
+            value = -self.shallow(opp & ~flips, own | flips | (1 << move), empty & ~(1 << move), n_empty - 1,
+                                  -beta, -alpha, False)
+            if value > best_value:
+                best_value = value
+                if value > alpha:
+                    alpha = value
+                    if alpha >= beta:
+                        return best_value
+        if best_value == -65:
+            if passed:
+                return final_diff(own, opp)  # neither can move
+            return -self.shallow(opp, own, empty, n_empty, -beta, -alpha, True)
+        return best_value
+
+    def last_move(self, own, opp, move):
+        # value with a single empty square, whoever can play it does
+        diff = final_diff(own, opp)
+        flips = bb_flips(own, opp, move)
+        if flips:
+            return diff + 2 * popcount(flips) + 1
+        flips = bb_flips(opp, own, move)
+        if flips:
+            return diff - 2 * popcount(flips) - 1
+        return diff
+
+def annotate_game(game, max_empties=14, best_moves=True, solver=None):
+    # (values [60, ] int8, best [60, ] uint64) of one game as in the module header
+    solver = solver if solver is not None else default_solver
+    values = np.full(60, unsolved, dtype=np.int8)
+    best = np.zeros(60, dtype=np.uint64)
+    own, opp = (1 << 28) | (1 << 35), (1 << 27) | (1 << 36)  # black, white
+    black_to_move = True
+    for t, move in enumerate(game):
+        flips = bb_flips(own, opp, move)
+        if not flips:  # forfeit, the opponent plays
+            own, opp, black_to_move = opp, own, not black_to_move
+            flips = bb_flips(own, opp, move)
+            assert flips, f"illegal move {move} at ply {t}"
+        own, opp = opp & ~flips, own | flips | (1 << move)
+        black_to_move = not black_to_move
+        if 59 - t > max_empties:
+            continue
+        if bb_moves(own, opp) == 0:
+            own, opp, black_to_move = opp, own, not black_to_move
+        if bb_moves(own, opp) == 0:
+            values[t] = final_diff(own, opp) if black_to_move else -final_diff(own, opp)
+            continue
+        value, moves = solver.solve_bitboards(own, opp, best_moves)
+        values[t] = value if black_to_move else -value
+        best[t] = sum(1 << m for m in moves)
+    return values, best
+
+default_solver = EndgameSolver()
+
+def annotate_worker(args):
+    return annotate_game(*args)
+
+def annotate_games(games, max_empties=14, best_moves=True, num_proc=None, chunksize=16):
+    # annotate_game of every game, stacked into (values [N, 60] int8, best [N, 60] uint64), on all processors
+    values = np.full((len(games), 60), unsolved, dtype=np.int8)
+    best = np.zeros((len(games), 60), dtype=np.uint64)
+    num_proc = num_proc if num_proc is not None else multiprocessing.cpu_count()
+    jobs = ((game, max_empties, best_moves) for game in games)
+    if num_proc > 1:
+        p = multiprocessing.Pool(num_proc)
+        results = p.imap(annotate_worker, jobs, chunksize=chunksize)
+    else:
+        results = map(annotate_worker, jobs)
+    for i, (v, b) in enumerate(tqdm(results, total=len(games))):
+        values[i], best[i] = v, b
+    if num_proc > 1:
+        p.close()
+    return values, best
+
+def annotate(othello, max_empties=14, best_moves=True, num_proc=None):
+    # side arrays for every game of an Othello dataset, aligned with othello.sequences
+    return annotate_games(othello.sequences, max_empties, best_moves, num_proc)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Annotate the tail of every game with its perfect-play value')
+    parser.add_argument('--data_root', default=None, type=str)
+    parser.add_argument('--ood_num', default=-1, type=int)
+    parser.add_argument('--max_empties', default=14, type=int)
+    parser.add_argument('--no_best', dest='best_moves', action='store_false')
+    parser.add_argument('--num_proc', default=None, type=int)
+    parser.add_argument('--out', required=True, type=str)
+    args = parser.parse_args()
+
+    othello = get(data_root=args.data_root, ood_num=args.ood_num)
+    values, best = annotate(othello, args.max_empties, args.best_moves, args.num_proc)
+    np.savez(args.out, values=values, best=best)
@@ -0,0 +1,83 @@
+# Positional features of every position of a batch of games, computed in one batched replay on the
+# numpy bitboards of BatchedOthelloBoards, as probing targets
+#   extract_features(moves, ["mobility", "stable"]) -> {"mobility": [N, T], "stable": [N, T, 64]}
+# moves is [N, T] board squares padded with move_pad or negative numbers; entry t of every feature
+# describes the board right after move t (past the end of a game, its last position repeats)
+import numpy as np
+
+from .othello import BatchedOthelloBoards, bb_to_array_np, bb_shift_np, bb_directions_np, popcount_np, move_pad
+from .endgame import line_masks, off_board
+
+# a feature is a function of (boards after the move, flipped [N, ] uint64, placed [N, ] uint64), giving
+# an [N, 64] array per square or an [N, ] array per position, stored with the dtype given here
+def frontier(boards, flips, placed):
+    # discs next to at least one empty square
+    occupied = boards.black | boards.white
+    empty = ~occupied
+    near_empty = np.zeros_like(occupied)
+    for direction in bb_directions_np:
+        near_empty |= bb_shift_np(empty, *direction)
+    return bb_to_array_np(occupied & near_empty)
+
+def stable_discs_np(own, opp):
+    # stable_discs of endgame.py on [N, ] uint64 bitboards
+    occupied = own | opp
+    full_lines = []
+    for lines in line_masks:
+        x = np.zeros_like(own)
+        for line in lines:
+            line = np.uint64(line)
+            x |= np.where(occupied & line == line, line, np.uint64(0))
+        full_lines.append(x)
+    safe = [np.uint64(_) for _ in off_board]
+    back = [bb_directions_np[(d + 4) % 8] for d in range(8)]  # as back_directions in endgame.py
+    stable = np.zeros_like(own)
+    while True:
+        x = own.copy()
+        for d in range(4):
+            x &= full_lines[d] | safe[d] | safe[d + 4] | bb_shift_np(stable, *back[d]) | bb_shift_np(stable, *back[d + 4])
+        if (x == stable).all():
+            return stable
+        stable = x
+
+def stable(boards, flips, placed):
+    # discs of either color that can not be flipped any more
+    return bb_to_array_np(stable_discs_np(boards.black, boards.white) | stable_discs_np(boards.white, boards.black))
+
+features = {
+    # per square, [N, T, 64]
+    "state": (lambda boards, flips, placed: boards.get_state(), np.int8),  # white 0, blank 1, black 2
+    "age": (lambda boards, flips, placed: boards.get_age(), np.int16),
+    "occupied": (lambda boards, flips, placed: boards.get_occupied(), bool),
+    "legal": (lambda boards, flips, placed: boards.get_legal(), bool),  # valid moves of the next player
+    "flipped": (lambda boards, flips, placed: bb_to_array_np(flips), bool),  # flipped by this move
+    "captured": (lambda boards, flips, placed: bb_to_array_np(flips | placed), bool),  # flipped or placed
+    "frontier": (frontier, bool),
+    "stable": (stable, bool),
+    # per position, [N, T]
+    "next_hand_color": (lambda boards, flips, placed: boards.get_next_hand_color(), np.int8),
+    "mobility": (lambda boards, flips, placed: popcount_np(boards.get_legal_bb()), np.int8),  # number of valid moves
+    "parity": (lambda boards, flips, placed: (64 - popcount_np(boards.black | boards.white)) % 2, np.int8),  # empties odd
+}
+per_square = {"state", "age", "occupied", "legal", "flipped", "captured", "frontier", "stable"}
+# number of classes of the per square features, for the probes
+feature_classes = {"state": 3, "age": 60, "occupied": 2, "legal": 2, "flipped": 2, "captured": 2, "frontier": 2, "stable": 2}
+
+def extract_features(moves, names, chunk_size=100000, strict=True):
+    # {name: [N, T, 64] or [N, T] array} for every name in names, illegal moves assert when strict
+    for name in names:
+        assert name in features, f"unknown feature {name}, should be one of {list(features)}"
+    moves = np.asarray(moves).astype(np.int64)
+    moves[moves == move_pad] = -1
+    N, T = moves.shape
+    tbr = {name: np.zeros((N, T, 64) if name in per_square else (N, T), dtype=features[name][1]) for name in names}
+    for start in range(0, N, chunk_size):
+        chunk = moves[start:start + chunk_size]
+        boards = BatchedOthelloBoards(len(chunk))
+        for t in range(T):
+            occupied = boards.black | boards.white
+            flips = boards.play(chunk[:, t], strict=strict)
+            placed = (boards.black | boards.white) & ~occupied
+            for name in names:
+                tbr[name][start:start + len(chunk), t] = features[name][0](boards, flips, placed)
+    return tbr
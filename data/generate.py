@@ -0,0 +1,110 @@
+# Streaming, sharded and reproducible generator of the synthetic corpus (uniformly random legal games)
+#   python -m data.generate --num_games 20000000 --seed 0
+# workers each play a chunk of games from a seed derived from (master seed, chunk index), the main process
+# keeps the chunks in order, drops duplicates with a set of 64-bit game hashes and writes a pickle of
+# shard_size games (the format Othello(ood_num=-1) loads) every time one is full, so memory stays bounded
+# by the hash set and one shard. Rerunning the same command after an interruption resumes: the hashes
+# of the written shards are reloaded and generation restarts at the chunk the last shard ended in, whose
+# already written games are then dropped as duplicates, giving the same shards as an uninterrupted run
+import os
+import json
+import random
+import pickle
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+import psutil
+from tqdm import tqdm
+
+from .othello import get_ood_game, wanna_use
+
+progress_name = "generate_progress.json"
+
+def chunk_seed(seed, chunk):
+    # independent, well mixed seed of every chunk, the same whatever worker plays it
+    return int(np.random.SeedSequence([seed, chunk]).generate_state(1, np.uint64)[0])
+
+def play_chunk(args):
+    seed, chunk, chunk_size = args
+    rng = random.Random(chunk_seed(seed, chunk))
+    return [get_ood_game(None, rng) for _ in range(chunk_size)]
+
+def game_hash(game):
+    # stable across processes and runs, unlike hash()
+    return int.from_bytes(hashlib.blake2b(bytes(game), digest_size=8).digest(), "little")
+
+def shard_path(out_dir, prefix, k):
+    return os.path.join(out_dir, f"{prefix}_{k:05d}.pickle")
+
+def atomic_dump(obj, path, dump):
+    # write to a temporary file first so an interruption never leaves a truncated shard behind
+    with open(path + ".tmp", "wb" if dump is pickle.dump else "w") as f:
+        dump(obj, f)
+    os.replace(path + ".tmp", path)
+
+def load_progress(out_dir, config):
+    # (next chunk, shards written, hashes of the written games), from scratch if there is no progress file
+    path = os.path.join(out_dir, progress_name)
+    if not os.path.exists(path):
+        return 0, 0, set()
+    with open(path) as f:
+        progress = json.load(f)
+    assert progress["config"] == config, f"{path} was written with {progress['config']}, delete it to start over"
+    seen = set()
+    for k in tqdm(range(progress["shards"]), desc="Reloading shards"):
+        with open(shard_path(out_dir, config["prefix"], k), "rb") as handle:
+            seen.update(game_hash(game) for game in pickle.load(handle))
+    return progress["next_chunk"], progress["shards"], seen
+
+def generate(num_games, out_dir, seed=0, shard_size=100000, chunk_size=1000, num_proc=None, prefix="gen10e5"):
+    # writes shards until num_games distinct games are on disk (the last shard may be smaller)
+    os.makedirs(out_dir, exist_ok=True)
+    config = {"num_games": num_games, "seed": seed, "shard_size": shard_size, "chunk_size": chunk_size, "prefix": prefix}
+    chunk, shards, seen = load_progress(out_dir, config)
+    num_proc = num_proc if num_proc is not None else multiprocessing.cpu_count()
+    window = num_proc * 4  # chunks in flight, so finished chunks never pile up in memory
+    shard = []
+    bar = tqdm(total=num_games, initial=len(seen))
+    p = multiprocessing.Pool(num_proc)
+    while len(seen) < num_games:
+        jobs = [(seed, c, chunk_size) for c in range(chunk, chunk + window)]
+        for games in p.imap(play_chunk, jobs):
+            for game in games:
+                key = game_hash(game)
+                if key in seen:
+                    continue
+                seen.add(key)
+                shard.append(game)
+                bar.update(1)
+                if len(shard) == shard_size or len(seen) == num_games:
+                    atomic_dump(shard, shard_path(out_dir, prefix, shards), pickle.dump)
+                    shards += 1
+                    shard = []
+                    # the rest of this chunk is regenerated on resume, its written games being duplicates by then
+                    progress = {"config": config, "next_chunk": chunk, "shards": shards}
+                    atomic_dump(progress, os.path.join(out_dir, progress_name), json.dump)
+                if len(seen) == num_games:
+                    break
+            if len(seen) == num_games:
+                break
+            chunk += 1
+        mem_gb = psutil.Process(os.getpid()).memory_info().rss / 2 ** 30
+        bar.set_description(f"Mem Used: {mem_gb:.4} GB")
+    p.close()
+    bar.close()
+    return shards
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate the synthetic dataset as shards of random legal games')
+    parser.add_argument('--num_games', default=20000000, type=int)
+    parser.add_argument('--out_dir', default=f"./data/{wanna_use}", type=str)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--shard_size', default=100000, type=int)  # Othello(ood_num=-1) expects 1e5 per file
+    parser.add_argument('--chunk_size', default=1000, type=int)
+    parser.add_argument('--num_proc', default=None, type=int)
+    parser.add_argument('--prefix', default="gen10e5", type=str)
+    args = parser.parse_args()
+
+    shards = generate(args.num_games, args.out_dir, args.seed, args.shard_size, args.chunk_size, args.num_proc, args.prefix)
+    print(f"{shards} shards in {args.out_dir}")
@@ -1,5 +1,6 @@
 import os
-import pgn
+import re
+import json
 import numpy as np
 import random
 from tqdm import tqdm
@@ -8,8 +9,8 @@ import multiprocessing
 import pickle
 import psutil
 import seaborn as sns
-import itertools
-from copy import copy, deepcopy
+from collections import OrderedDict
+from copy import copy
 from matplotlib.patches import Rectangle, Circle
 from matplotlib.collections import PatchCollection
 from matplotlib.colors import ListedColormap
@@ -58,19 +59,107 @@ def permit_reverse(integer):
 start_hands = [permit(_) for _ in ["d5", "d4", "e4", "e5"]]
 eights = [[-1, 0], [-1, 1], [0, 1], [1, 1], [1, 0], [1, -1], [0, -1], [-1, -1]]
 
+def build_rays():
+    # rays[move][d] is the tuple of squares met walking from move in direction eights[d],
+    # nearest first, empty when move is on the edge it would walk off
+    tbr = []
+    for move in range(64):
+        r, c = move // 8, move % 8
+        move_rays = []
+        for dr, dc in eights:
+            ray = []
+            cur_r, cur_c = r + dr, c + dc
+            while 0 <= cur_r < 8 and 0 <= cur_c < 8:
+                ray.append(cur_r * 8 + cur_c)
+                cur_r, cur_c = cur_r + dr, cur_c + dc
+            move_rays.append(tuple(ray))
+        tbr.append(tuple(move_rays))
+    return tuple(tbr)
+
+rays = build_rays()
+# the (up to 8) squares adjacent to each square
+neighbors = tuple(tuple(ray[0] for ray in move_rays if ray) for move_rays in rays)
+
+# Zobrist hashing: a position hashes to the xor of one fixed random 64-bit key per disc (square and color),
+# xor-ed with zobrist_white_to_move when white is to move; the seed is fixed so keys agree across processes
+zobrist_rng = np.random.default_rng(20221026)
+zobrist_keys = {
+    1: zobrist_rng.integers(0, 2 ** 64, size=64, dtype=np.uint64).tolist(),
+    -1: zobrist_rng.integers(0, 2 ** 64, size=64, dtype=np.uint64).tolist(),
+}
+zobrist_white_to_move = int(zobrist_rng.integers(0, 2 ** 64, dtype=np.uint64))
+
+def zobrist_hash(cells):
+    # hash of the discs of a flat list of 64 cells in {1, 0, -1}, side to move not included
+    tbr = 0
+    for sq, v in enumerate(cells):
+        if v != 0:
+            tbr ^= zobrist_keys[v][sq]
+    return tbr
+
+def canonical_zobrist(cells, next_hand_color):
+    # position key of a flat list of 64 cells and the side to move up to the start-preserving symmetries,
+    # the smallest of the 4 images; engines build cells their own way and share this
+    tbr = None
+    for k in start_symmetries:
+        perm = symmetry_perms[k]
+        zobrist = 0
+        for sq, v in enumerate(cells):
+            if v != 0:
+                zobrist ^= zobrist_keys[v][perm[sq]]
+        tbr = zobrist if tbr is None else min(tbr, zobrist)
+    if next_hand_color == -1:
+        tbr ^= zobrist_white_to_move
+    return tbr
+
+class PositionCache():
+    # bounded LRU memo of derived features, keyed by (position key, feature name, *arguments)
+    # values are shared between every caller asking for the same key, treat them as read-only
+    def __init__(self, maxsize=2 ** 20):
+        self.maxsize = maxsize
+        self.store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self, ):
+        return len(self.store)
+
+    def get(self, key, fn):
+        # cached value of key, computed with fn() on a miss
+        try:
+            tbr = self.store[key]
+        except KeyError:
+            self.misses += 1
+            tbr = self.store[key] = fn()
+            if len(self.store) > self.maxsize:
+                self.store.popitem(last=False)
+            return tbr
+        self.hits += 1
+        self.store.move_to_end(key)
+        return tbr
+
+    def clear(self, ):
+        self.store.clear()
+        self.hits = 0
+        self.misses = 0
+
+position_cache = PositionCache()
+
 wanna_use = "othello_synthetic"
 
 class Othello:
-    def __init__(self, ood_perc=0., data_root=None, wthor=False, ood_num=1000):
+    def __init__(self, ood_perc=0., data_root=None, wthor=False, ood_num=1000, mem_gb=None):
         # ood_perc: probability of swapping an in-distribution game (real championship game)
         # with a generated legit but stupid game, when data_root is None, should set to 0
         # data_root: if provided, will load pgn files there, else load from data/gen10e5
         # ood_num: how many simulated games to use, if -1, load 200 * 1e5 games = 20 million
+        # mem_gb: memory budget when reading the pickled shards, bounds how many are unpickled at once
         self.ood_perc = ood_perc
         self.sequences = []
         self.results = []
         self.board_size = 8 * 8
-        criteria = lambda fn: fn.endswith("pgn") if wthor else fn.startswith("liveothello")
+        self.vocab = {"chars": othello_chars, "max_len": othello_max_len}  # fixed, CharDataset reads it instead of scanning
+        criteria = lambda fn: fn.endswith(("pgn", ".wtb")) if wthor else fn.startswith("liveothello")
         if data_root is None:
             if ood_num == 0:
                 return
@@ -78,74 +167,45 @@ class Othello:
                 if ood_num != -1:  # this setting used for generating synthetic dataset
                     num_proc = multiprocessing.cpu_count() # use all processors
                     p = multiprocessing.Pool(num_proc)
-                    for can in tqdm(p.imap(get_ood_game, range(ood_num)), total=ood_num):
-                        if not can in self.sequences:
+                    seen = set()
+                    for can in tqdm(p.imap(get_ood_game, range(ood_num), chunksize=64), total=ood_num):
+                        key = bytes(can)
+                        if key not in seen:
+                            seen.add(key)
                             self.sequences.append(can)
                     p.close()
                     t_start = time.strftime("_%Y%m%d_%H%M%S")
                     if ood_num > 1000:
                         with open(f'./data/{wanna_use}/gen10e5_{t_start}.pickle', 'wb') as handle:
                             pickle.dump(self.sequences, handle, protocol=pickle.HIGHEST_PROTOCOL)
-                else:
-                    bar = tqdm(os.listdir(f"./data/{wanna_use}"))
-                    trash = []
-                    cnt = 0 
-                    for f in bar:
-                        if not f.endswith(".pickle"):
-                            continue
-                        with open(os.path.join(f"./data/{wanna_use}", f), 'rb') as handle:
-                            cnt += 1
-                            if cnt > 250:
-                                break
-                            b = pickle.load(handle)
-                            if len(b) < 9e4:  # should be 1e5 each
-                                trash.append(f)
-                                continue
-                            self.sequences.extend(b)
-                        process = psutil.Process(os.getpid())
-                        mem_gb = process.memory_info().rss / 2 ** 30
-                        bar.set_description(f"Mem Used: {mem_gb:.4} GB")
-                    print("Deduplicating...")
-                    seq = self.sequences
-                    seq.sort()
-                    self.sequences = [k for k, _ in itertools.groupby(seq)]
-                    for t in trash:
-                        os.remove(os.path.join(f"./data/{wanna_use}", f))
-                    print(f"Deduplicating finished with {len(self.sequences)} games left")
+                elif os.path.exists(os.path.join(packed_store, "manifest.json")):
+                    # written by python -m data.store or data.dedup, deduplicated and sorted like load_shards below
+                    self.sequences = load_store(packed_store)
+                    self.vocab = self.sequences.vocab
+                    print(f"Memory mapped {len(self.sequences)} games from {packed_store}")
                     self.val = self.sequences[20000000:]
                     self.sequences = self.sequences[:20000000]
                     print(f"Using 20 million for training, {len(self.val)} for validation")
+                else:
+                    folder = f"./data/{wanna_use}"
+                    paths = sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".pickle"))[:250]
+                    self.sequences, self.val = load_shards(paths, train_size=20000000, mem_gb=mem_gb)
+                    print(f"Using {len(self.sequences)} for training, {len(self.val)} for validation")
         else:
-            for fn in os.listdir(data_root):
-                if criteria(fn):
-                    with open(os.path.join(data_root, fn), "r") as f:
-                        pgn_text = f.read()
-                    games = pgn.loads(pgn_text)
-                    num_ldd = len(games)
-                    processed = []
-                    res = []
-                    for game in games:
-                        tba = []
-                        for move in game.moves:
-                            x = permit(move)
-                            if x != -1:
-                                tba.append(x)
-                            else:
-                                break
-                        if len(tba) != 0:
-                            try:
-                                rr = [int(s) for s in game.result.split("-")]
-                            except:
-                                # print(game.result)
-                                # break
-                                rr = [0, 0]
-                            res.append(rr)
-                            processed.append(tba)
-
-                    num_psd = len(processed)
-                    print(f"Loaded {num_psd}/{num_ldd} (qualified/total) sequences from {fn}")
-                    self.sequences.extend(processed)
-                    self.results.extend(res)
+            fns = [fn for fn in os.listdir(data_root) if criteria(fn)]
+            paths = [os.path.join(data_root, fn) for fn in fns]
+            num_proc = min(multiprocessing.cpu_count(), len(paths))
+            if num_proc > 1:  # one file per task, games come back in file order
+                p = multiprocessing.Pool(num_proc)
+                loaded = p.imap(load_game_file, paths)
+            else:
+                loaded = map(load_game_file, paths)
+            for fn, (processed, res, num_ldd) in zip(fns, loaded):
+                print(f"Loaded {len(processed)}/{num_ldd} (qualified/total) sequences from {fn}")
+                self.sequences.extend(processed)
+                self.results.extend(res)
+            if num_proc > 1:
+                p.close()
         
     def __len__(self, ):
         return len(self.sequences)
@@ -156,20 +216,276 @@ class Othello:
             tbr = self.sequences[i]
         return tbr
     
-def get_ood_game(_):
+def get_ood_game(_, rng=random):
+    # a uniformly random legal game, rng is anything with a choice method (random.Random for reproducible games)
     tbr = []
-    ab = OthelloBoardState()
+    ab = OthelloBitBoardState()
     possible_next_steps = ab.get_valid_moves()
     while possible_next_steps:
-        next_step = random.choice(possible_next_steps)
+        next_step = rng.choice(possible_next_steps)
         tbr.append(next_step)
         ab.update([next_step, ])
         possible_next_steps = ab.get_valid_moves()
     return tbr
     
-def get(ood_perc=0., data_root=None, wthor=False, ood_num=1000):
-    return Othello(ood_perc, data_root, wthor, ood_num)
+move_pad = 255  # padding of the uint8 move arrays, past the end of a game
+# the vocabulary of every Othello corpus, the pad -100 then the 60 squares a move can be played on, and the
+# longest game; sorted as CharDataset would find them scanning the games, so the token ids are the same
+othello_chars = [-100] + [s for s in range(64) if s not in (27, 28, 35, 36)]
+othello_max_len = 60
+
+def pad_moves(games, length=60):
+    # list of games -> [N, length] uint8 padded with move_pad
+    tbr = np.full((len(games), length), move_pad, dtype=np.uint8)
+    for i, game in enumerate(games):
+        tbr[i, :len(game)] = game
+    return tbr
+
+# Packed game store: a directory with moves.bin, the raw [N, 60] uint8 move matrix padded with move_pad,
+# lengths.npy, [N, ] uint8, and manifest.json describing them; load_store memory maps both, so opening
+# even the 20 million game corpus takes no time and no memory until games are read
+packed_store = f"./data/{wanna_use}/packed"
+store_version = 1
+
+class PackedGames():
+    # read-only sequence of the games of a move matrix, games come out as lists of ints like the pickles
+    def __init__(self, moves, lengths, vocab=None):
+        self.moves = moves
+        self.lengths = lengths
+        self.vocab = vocab if vocab is not None else {"chars": othello_chars, "max_len": othello_max_len}
+
+    def __len__(self, ):
+        return len(self.lengths)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return PackedGames(self.moves[i], self.lengths[i], self.vocab)
+        return self.moves[i, :self.lengths[i]].tolist()
+
+    def __iter__(self, ):
+        for start in range(0, len(self), 10000):  # a block of rows at a time, not one memmap access per game
+            moves, lengths = self.moves[start:start + 10000].tolist(), self.lengths[start:start + 10000].tolist()
+            for m, l in zip(moves, lengths):
+                yield m[:l]
+
+def write_store(path, moves, lengths, **meta):
+    # moves [N, 60] uint8 padded with move_pad, lengths [N, ]; meta goes to the manifest as is
+    moves = np.ascontiguousarray(moves, dtype=np.uint8)
+    assert moves.ndim == 2 and moves.shape[1] == 60 and len(lengths) == len(moves)
+    os.makedirs(path, exist_ok=True)
+    moves.tofile(os.path.join(path, "moves.bin"))
+    np.save(os.path.join(path, "lengths.npy"), np.asarray(lengths, dtype=np.uint8))
+    write_manifest(path, len(moves), **meta)
+
+def write_manifest(path, num_games, **meta):
+    # the manifest of a store whose moves.bin and lengths.npy are already at path
+    manifest = {"version": store_version, "num_games": num_games, "max_len": othello_max_len, "chars": othello_chars,
+                "move_pad": move_pad, "moves": "moves.bin", "lengths": "lengths.npy", **meta}
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def read_manifest(path):
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    assert manifest["version"] == store_version, f"{path} has store version {manifest['version']}, expected {store_version}"
+    return manifest
+
+def load_store(path):
+    # PackedGames over the memory mapped store at path
+    manifest = read_manifest(path)
+    n = manifest["num_games"]
+    moves = np.memmap(os.path.join(path, manifest["moves"]), dtype=np.uint8, mode="r", shape=(n, manifest["max_len"]))
+    lengths = np.load(os.path.join(path, manifest["lengths"]), mmap_mode="r")
+    assert len(lengths) == n, f"{path} lists {n} games but has {len(lengths)} lengths"
+    # stores written before the vocabulary was in the manifest hold Othello games all the same
+    vocab = {"chars": manifest.get("chars", othello_chars), "max_len": manifest["max_len"]}
+    return PackedGames(moves, lengths, vocab)
+
+# WTHOR database files (.wtb): a 16-byte header (creation date, number of games as uint32 at byte 4,
+# year of the games, board size, ...) followed by one 68-byte record per game, moves coded as
+# 10 * digit + letter index (11 is a1, 0 ends the game); letter and digit are swapped to follow permit()
+wthor_header_size = 16
+wthor_record = np.dtype([("tournament", "<u2"), ("black_player", "<u2"), ("white_player", "<u2"),
+                         ("black_score", "u1"), ("theoretical_score", "u1"), ("moves", "u1", (60, ))])
+wthor_to_square = np.full(256, -1, dtype=np.int16)
+for r in range(8):
+    for c in range(8):
+        wthor_to_square[10 * (c + 1) + r + 1] = permit(rows[r] + columns[c])
+
+def read_wthor(path):
+    # memory maps a .wtb file and decodes every game at once
+    # returns (moves [N, 60] uint8 padded with move_pad, lengths [N, ], results [N, 2] as [black, white] discs)
+    # a game stops at its first empty or invalid move code
+    n = int(np.fromfile(path, dtype="<u4", count=1, offset=4)[0])
+    assert os.path.getsize(path) == wthor_header_size + n * wthor_record.itemsize, f"{path} is not a WTHOR game file"
+    if n == 0:
+        return np.zeros((0, 60), dtype=np.uint8), np.zeros(0, dtype=np.int64), np.zeros((0, 2), dtype=np.int64)
+    records = np.memmap(path, dtype=wthor_record, mode="r", offset=wthor_header_size, shape=(n, ))
+    squares = wthor_to_square[records["moves"]]
+    valid = np.logical_and.accumulate(squares >= 0, axis=1)
+    lengths = valid.sum(1)
+    moves = np.where(valid, squares, move_pad).astype(np.uint8)
+    black = records["black_score"].astype(np.int64)
+    return moves, lengths, np.stack([black, 64 - black], axis=1)
+
+# Parallel loading of the pickled shards: workers unpickle shards and send back packed move matrices,
+# duplicates are found by a 64-bit hash of every game (random keys per ply and square, xor-ed) instead
+# of sorting the Python lists, then the distinct games are sorted as the lists used to be, which is what
+# the 20 million train / val split of the checkpoints was taken from
+game_hash_keys = np.random.default_rng(20221027).integers(0, 2 ** 64, size=(60, 256), dtype=np.uint64)
+shard_mem_factor = 20  # an unpickled list of lists of ints takes about this many times its pickle size
+
+def hash_games(moves):
+    # [N, 60] uint8 padded with move_pad -> [N, ] uint64, a column at a time so only the result is N x 8 bytes
+    tbr = np.zeros(len(moves), dtype=np.uint64)
+    for t in range(moves.shape[1]):
+        tbr ^= game_hash_keys[t][moves[:, t]]
+    return tbr
+
+def sort_games(moves):
+    # rows of an [N, T] uint8 move matrix in the order Python sorts the games as lists (a game before its
+    # continuations): move_pad wraps around to 0, below every square, and the rows are lexsorted;
+    # moves is shifted in place for that and back, so it has to be writable but is not copied
+    assert move_pad == 255
+    moves += np.uint8(1)
+    order = np.lexsort(moves.T[::-1])
+    moves -= np.uint8(1)
+    return moves[order]
+
+def load_shard(args):
+    path, min_games = args
+    with open(path, "rb") as handle:
+        games = pickle.load(handle)
+    if len(games) < min_games:  # should be 1e5 each
+        return np.zeros((0, 60), dtype=np.uint8)
+    return pad_moves(games)
+
+def read_shards(paths, mem_gb=None, min_games=9e4):
+    # generator of the packed [n, 60] move matrix of every shard in order, read by as many worker
+    # processes as the memory budget (in GB, None for no limit) allows for unpickling at the same time
+    if not paths:
+        return
+    num_proc = multiprocessing.cpu_count()
+    if mem_gb is not None:
+        shard_gb = shard_mem_factor * max(os.path.getsize(p) for p in paths) / 2 ** 30
+        num_proc = max(1, min(num_proc, int(mem_gb / shard_gb)))
+    # a fresh worker per shard gives the unpickled lists back to the system, and a window of num_proc
+    # shards at a time means nothing is read ahead of what is used
+    p = multiprocessing.Pool(num_proc, maxtasksperchild=1)
+    bar = tqdm(total=len(paths))
+    try:
+        for start in range(0, len(paths), num_proc):
+            for moves in p.imap(load_shard, [(path, min_games) for path in paths[start:start + num_proc]]):
+                bar.update(1)
+                mem = psutil.Process(os.getpid()).memory_info().rss / 2 ** 30
+                bar.set_description(f"Mem Used: {mem:.4} GB")
+                yield moves
+    finally:  # also when the consumer stops early, the workers may still be unpickling
+        bar.close()
+        p.terminate()
+
+def read_distinct(paths, mem_gb=None, min_games=9e4):
+    # [N, 60] uint8 distinct games of the shards, sorted; every shard is hashed once as it arrives and a
+    # single np.unique over the hashes finds the first occurrences, so besides the packed shards only
+    # 8 bytes per game are held, and the repeats are dropped shard by shard
+    blocks, hashes = [], []
+    for moves in read_shards(paths, mem_gb, min_games):
+        blocks.append(moves)
+        hashes.append(hash_games(moves))
+    if not blocks:
+        return np.zeros((0, 60), dtype=np.uint8)
+    _, first = np.unique(np.concatenate(hashes), return_index=True)
+    del hashes
+    keep = np.zeros(sum(len(_) for _ in blocks), dtype=bool)
+    keep[first] = True
+    del first
+    kept, start = [], 0
+    while blocks:
+        moves = blocks.pop(0)
+        kept.append(moves[keep[start:start + len(moves)]])
+        start += len(moves)
+    moves = np.concatenate(kept)
+    del kept
+    return sort_games(moves)
+
+def load_shards(paths, train_size=20000000, mem_gb=None, min_games=9e4):
+    # (train, val) PackedGames: the distinct games of all the shards in sorted order, split at train_size
+    # every shard is needed before the first training game is known
+    moves = read_distinct(paths, mem_gb, min_games)
+    lengths = (moves != move_pad).sum(1).astype(np.uint8)
+    return PackedGames(moves[:train_size], lengths[:train_size]), PackedGames(moves[train_size:], lengths[train_size:])
+
+def get(ood_perc=0., data_root=None, wthor=False, ood_num=1000, mem_gb=None):
+    return Othello(ood_perc, data_root, wthor, ood_num, mem_gb)
     
+# square of every move string permit() accepts, so parsing is a dict lookup per move
+square_lookup = {s: permit(s) for s in (r + c for r in rows for c in columns)}
+square_lookup.update({s.upper(): sq for s, sq in list(square_lookup.items())})
+move_number = re.compile(r"\d+\.+")
+
+def iter_pgn(path):
+    # generator of (moves, [black, white] discs) for every game of a pgn file, read line by line
+    # the moves of a game stop at the first token that is not a square (result, comment, ...), as with
+    # the pgn package, so malformed move text gives a shorter or empty game; text before any tag is ignored
+    tags, moves, stopped = None, [], False
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            line = line.split(";", 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith("["):
+                if tags is None or moves or stopped:  # first tag of the next game
+                    if tags is not None:
+                        yield moves, pgn_result(tags)
+                    tags, moves, stopped = {}, [], False
+                parts = line[1:].split(None, 1)
+                if parts:
+                    tags[parts[0].lower()] = parts[1].strip('"[] ') if len(parts) > 1 else ""
+            elif tags is not None and not stopped:
+                for token in move_number.sub(" ", line).split():
+                    sq = square_lookup.get(token)
+                    if sq is None:
+                        stopped = True
+                        break
+                    moves.append(sq)
+    if tags is not None:
+        yield moves, pgn_result(tags)
+
+def pgn_result(tags):
+    try:
+        return [int(s) for s in tags.get("result", "").split("-")]
+    except ValueError:
+        return [0, 0]
+
+def load_game_file(path):
+    # (games, results, number of games in the file) of a .wtb or pgn file, games without moves dropped
+    if path.endswith(".wtb"):
+        moves, lengths, res = read_wthor(path)
+        keep = lengths > 0
+        return [m[:l] for m, l in zip(moves[keep].tolist(), lengths[keep].tolist())], res[keep].tolist(), len(moves)
+    games, results, total = [], [], 0
+    for moves, res in iter_pgn(path):
+        total += 1
+        if moves:
+            games.append(moves)
+            results.append(res)
+    return games, results, total
+
+# what get_gt_multi can collect, and the dtype of each array
+gt_dtypes = {"state": np.int8, "age": np.int16, "occupied": bool, "legal": bool, "flipped": bool, "next_hand_color": np.int8}
+gt_features = tuple(gt_dtypes)
+
+class BoardSnapshot():
+    # compact, self-contained copy of a board position (no arrays shared with the board)
+    # works for any engine exposing state, age, next_hand_color and history
+    __slots__ = ("cells", "age", "next_hand_color", "history")
+
+    def __init__(self, board):
+        self.cells = np.asarray(board.state).reshape(-1).astype(np.int8)
+        self.age = np.asarray(board.age).reshape(-1).astype(np.int8)
+        self.next_hand_color = int(board.next_hand_color)
+        self.history = bytes(board.history)
+
 class OthelloBoardState():
     # 1 is black, -1 is white
     def __init__(self, board_size = 8):
@@ -184,6 +500,120 @@ class OthelloBoardState():
         self.age = np.zeros((8, 8))
         self.next_hand_color = 1
         self.history = []
+        self.undo_stack = []
+
+    # umpire records the squares it changes in self.dirty; get_valid_moves and tentative_move first recheck the empty squares those
+    # can affect (settle), so self.legal (for each color, the squares where it would flip something)
+    # is a lookup there, and replaying moves without asking for legal moves pays nothing for it;
+    # move generation reads self.cells, a flat list mirror of self.state;
+    # assigning self.state rebuilds all of them, and so does sync() when self.state was edited in place
+    # (an intervention like board.state[r, c] = 1), which every method reading them calls first
+    @property
+    def state(self, ):
+        return self._state
+
+    @state.setter
+    def state(self, board):
+        self._state = np.ascontiguousarray(board)  # umpire writes through reshape(-1) views
+        self.refresh()
+
+    def refresh(self, ):
+        self.cells = [int(_) for _ in self._state.flatten().tolist()]
+        cells = self.cells
+        self.zobrist = zobrist_hash(cells)
+        self.legal = {1: set(), -1: set()}
+        # every empty square next to a disc, they are empty so settle rechecks them themselves
+        self.dirty = {n for move in range(64) if cells[move] != 0 for n in neighbors[move] if cells[n] == 0}
+        self.synced = self._state.tobytes()
+
+    def sync(self, ):
+        # rebuild the mirrors if self.state changed behind umpire's back, a 512 byte compare otherwise
+        if self._state.tobytes() != self.synced:
+            self.refresh()
+
+    def set_square(self, move, color):
+        # put color (1 black, -1 white, 0 blank) at move, for interventions; works the same on both engines
+        state = np.array(self.state)
+        state.reshape(-1)[move] = color
+        self.state = state
+
+    def recheck(self, squares):
+        # recompute legality of squares, all of which must be empty, for both colors
+        for move in squares:
+            for color in (1, -1):
+                if self.is_legal(move, color):
+                    self.legal[color].add(move)
+                else:
+                    self.legal[color].discard(move)
+
+    def settle(self, ):
+        # bring self.legal up to date with the squares changed since the last call: an empty square can
+        # only change legality if a changed square is on one of its rays behind a contiguous run of discs
+        self.sync()
+        if self.dirty:
+            cells = self.cells
+            self.recheck(self.affected_squares(self.dirty) | {sq for sq in self.dirty if cells[sq] == 0})
+            self.dirty = set()
+
+    def is_legal(self, move, color):
+        # whether color dropping a piece at (empty) move flips anything
+        cells = self.cells
+        for ray in rays[move]:
+            if len(ray) < 2 or cells[ray[0]] != -color:
+                continue
+            for sq in ray[1:]:
+                if cells[sq] != -color:
+                    if cells[sq] == color:
+                        return True
+                    break
+        return False
+
+    def get_flips(self, move, color):
+        # squares of the pieces flipped if color drops a piece at move, empty if none
+        cells = self.cells
+        tbf = []
+        for ray in rays[move]:
+            for k, sq in enumerate(ray):
+                if cells[sq] != -color:
+                    if cells[sq] == color and k:
+                        tbf.extend(ray[:k])
+                    break
+        return tbf
+
+    def affected_squares(self, changed):
+        # empty squares whose legality can change when the squares in changed change color:
+        # along every direction, the first empty square reached through a contiguous run of discs
+        cells = self.cells
+        tbr = set()
+        for move in changed:
+            for ray in rays[move]:
+                for sq in ray:
+                    if cells[sq] == 0:
+                        tbr.add(sq)
+                        break
+        return tbr
+
+    def position_key(self, ):
+        # zobrist hash of the discs and the side to move
+        self.sync()
+        if self.next_hand_color == -1:
+            return self.zobrist ^ zobrist_white_to_move
+        return self.zobrist
+
+    def canonical_position_key(self, ):
+        # position_key of the position up to the start-preserving symmetries (the smallest of the 4 images),
+        # lets a cache share entries between mirrored positions
+        self.sync()
+        return canonical_zobrist(self.cells, self.next_hand_color)
+
+    def cached(self, func, *args, fn=None, cache=None):
+        # getattr(self, func)(*args), or fn(*args) if given, memoized for the current position in cache
+        # (position_cache by default); only for features of the position, not of the history like get_age
+        if cache is None:
+            cache = position_cache
+        if fn is None:
+            fn = getattr(self, func)
+        return cache.get((self.position_key(), func) + args, lambda: fn(*args))
 
     def get_occupied(self, ):
         board = self.state
@@ -207,44 +637,18 @@ class OthelloBoardState():
             if prt:
                 self.__print__()
 
-    def umpire(self, move):
+    def umpire(self, move, undo=False):
+        # returns the squares flipped by the move
+        # undo: record what the move changes on self.undo_stack so unmake_move() can take it back
         r, c = move // 8, move % 8
-        assert self.state[r, c] == 0, f"{r}-{c} is already occupied!"
-        occupied = np.sum(self.state != 0)
-        color = self.next_hand_color
-        tbf = []
-        for direction in eights:
-            buffer = []
-            cur_r, cur_c = r, c
-            while 1:
-                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                    break
-                if self.state[cur_r, cur_c] == 0:
-                    break
-                elif self.state[cur_r, cur_c] == color:
-                    tbf.extend(buffer)
-                    break
-                else:
-                    buffer.append([cur_r, cur_c])
+        self.sync()
+        assert self.cells[move] == 0, f"{r}-{c} is already occupied!"
+        prev_hand_color = color = self.next_hand_color
+        tbf = self.get_flips(move, color)
         if len(tbf) == 0:  # means one hand is forfeited
             # print(f"One {color} move forfeited")
             color *= -1
-            self.next_hand_color *= -1
-            for direction in eights:
-                buffer = []
-                cur_r, cur_c = r, c
-                while 1:
-                    cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                    if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                        break
-                    if self.state[cur_r, cur_c] == 0:
-                        break
-                    elif self.state[cur_r, cur_c] == color:
-                        tbf.extend(buffer)
-                        break
-                    else:
-                        buffer.append([cur_r, cur_c])
+            tbf = self.get_flips(move, color)
         if len(tbf) == 0:
             valids = self.get_valid_moves()
             if len(valids) == 0:
@@ -252,15 +656,87 @@ class OthelloBoardState():
             else:
                 assert 0, "Illegal move!"
                 
-        self.age += 1
-        for ff in tbf:
-            self.state[ff[0], ff[1]] *= -1
-            self.age[ff[0], ff[1]] = 0
-        self.state[r, c] = color
-        self.age[r, c] = 0
-        self.next_hand_color *= -1
+        flat_state, flat_age = self.state.reshape(-1), self.age.reshape(-1)
+        if undo:
+            self.undo_stack.append((move, tbf, color, prev_hand_color, flat_age[tbf + [move]], self.zobrist))
+        flat_age += 1
+        flat_state[tbf] = color
+        flat_age[tbf] = 0
+        flat_state[move] = color
+        flat_age[move] = 0
+        cells = self.cells
+        zobrist = self.zobrist ^ zobrist_keys[color][move]
+        for sq in tbf:
+            cells[sq] = color
+            zobrist ^= zobrist_keys[color][sq] ^ zobrist_keys[-color][sq]
+        cells[move] = color
+        self.zobrist = zobrist
+        self.next_hand_color = -color  # the opponent of whoever moved, after a forfeit too
         self.history.append(move)
-        
+
+        self.legal[1].discard(move)
+        self.legal[-1].discard(move)
+        self.dirty.update(tbf)
+        self.dirty.add(move)
+        self.synced = self._state.tobytes()
+        return tbf
+
+    def make_move(self, move):
+        # umpire(move) that can be taken back with unmake_move() in O(flips)
+        self.umpire(move, undo=True)
+
+    def unmake_move(self, ):
+        self.sync()
+        move, tbf, color, prev_hand_color, prev_age, zobrist = self.undo_stack.pop()
+        flat_state, flat_age = self.state.reshape(-1), self.age.reshape(-1)
+        flat_age -= 1
+        flat_state[tbf] = -color
+        flat_state[move] = 0
+        flat_age[tbf + [move]] = prev_age
+        cells = self.cells
+        for sq in tbf:
+            cells[sq] = -color
+        cells[move] = 0
+        self.zobrist = zobrist
+        self.next_hand_color = prev_hand_color
+        self.history.pop()
+
+        # move is empty again and its empty neighbors are the first square of its rays, so settle also
+        # drops the ones no longer next to any disc
+        self.dirty.update(tbf)
+        self.dirty.add(move)
+        self.synced = self._state.tobytes()
+
+    def snapshot(self, ):
+        return BoardSnapshot(self)
+
+    def restore(self, snapshot):
+        # go back to a BoardSnapshot, dropping the undo stack
+        self.age = snapshot.age.reshape(8, 8).astype(float)
+        self.next_hand_color = snapshot.next_hand_color
+        self.history = list(snapshot.history)
+        self.undo_stack = []
+        self.state = snapshot.cells.reshape(8, 8).astype(float)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        tbr = cls()
+        tbr.restore(snapshot)
+        return tbr
+
+    def clone(self, ):
+        # independent copy of the board without the deepcopy of everything, the undo stack is not copied
+        tbr = copy(self)
+        tbr._state = self._state.copy()
+        tbr.initial_state = tbr._state
+        tbr.age = self.age.copy()
+        tbr.cells = self.cells[:]
+        tbr.legal = {1: set(self.legal[1]), -1: set(self.legal[-1])}
+        tbr.dirty = set(self.dirty)
+        tbr.history = self.history[:]
+        tbr.undo_stack = []
+        return tbr
+
     def __print__(self, ):
         print("-"*20)
         print([permit_reverse(_) for _ in self.history])
@@ -289,10 +765,10 @@ class OthelloBoardState():
         assert len(heatmap) == 64
         heatmap = np.array(heatmap).reshape(8, 8)
         annot = [trs[_] for _ in self.state.flatten().tolist()]
-        cloned = deepcopy(self)
-        cloned.update([pdmove, ])
-
-        next_color = 1 - cloned.get_next_hand_color()
+        # the color the move would be played by, found without playing it; an illegal prediction (common
+        # from probes) is drawn for the side to move
+        legality = self.tentative_move(pdmove)
+        next_color = ((-self.next_hand_color if legality == 2 else self.next_hand_color) + 1) // 2
         annot[pdmove] = ("\\underline{" + (trs[next_color * 2 -1]) + "}")[-13:]
 
         color = {-1:'white', 0:'grey', 1:'black'}
@@ -300,7 +776,6 @@ class OthelloBoardState():
         # ann_col[pdmove] = color[next_color * 2 -1]
         text_for_next_color = color[next_color * 2 -1].capitalize()
 
-        del cloned
         if logit:
             max_logit = np.max(np.abs(heatmap))
             sns.heatmap(data=heatmap, cbar=False, xticklabels=list(range(1,9)), 
@@ -312,7 +787,7 @@ class OthelloBoardState():
                         # cmap=LinearSegmentedColormap.from_list("custom_cmap",  ["#D3D3D3", "#B90E0A"]),
                         cmap=sns.color_palette("vlag", as_cmap=True), 
                         yticklabels=list("ABCDEFGH"), ax=ax, fmt="", square=True, linewidths=.5, vmin=-1, vmax=1, center=0)
-        ax.set_title(f"Prediction: {text_for_next_color} at " + permit_reverse(pdmove).upper())
+        ax.set_title(f"Prediction: {text_for_next_color} at " + permit_reverse(pdmove).upper() + ("" if legality else " (illegal)"))
         ax.add_patch(Rectangle((pdmove%8, pdmove//8), 1, 1, fill=False, edgecolor='black', lw=2))
 
         patchList = []
@@ -328,81 +803,529 @@ class OthelloBoardState():
         # returns 0 if this is not a move at all: occupied or both player have to forfeit
         # return 1 if regular move
         # return 2 if forfeit happens but the opponent can drop piece at this place
-        r, c = move // 8, move % 8
-        if not self.state[r, c] == 0:
-            return 0
-        occupied = np.sum(self.state != 0)
-        color = self.next_hand_color
-        tbf = []
-        for direction in eights:
-            buffer = []
-            cur_r, cur_c = r, c
-            while 1:
-                cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                    break
-                if self.state[cur_r, cur_c] == 0:
-                    break
-                elif self.state[cur_r, cur_c] == color:
-                    tbf.extend(buffer)
-                    break
-                else:
-                    buffer.append([cur_r, cur_c])
-        if len(tbf) != 0:
+        self.settle()
+        if move in self.legal[self.next_hand_color]:
             return 1
-        else:  # means one hand is forfeited
-            # print(f"One {color} move forfeited")
-            color *= -1
-            # self.next_hand_color *= -1
-            for direction in eights:
-                buffer = []
-                cur_r, cur_c = r, c
-                while 1:
-                    cur_r, cur_c = cur_r + direction[0], cur_c + direction[1]
-                    if cur_r < 0  or cur_r > 7 or cur_c < 0 or cur_c > 7:
-                        break
-                    if self.state[cur_r, cur_c] == 0:
-                        break
-                    elif self.state[cur_r, cur_c] == color:
-                        tbf.extend(buffer)
-                        break
-                    else:
-                        buffer.append([cur_r, cur_c])
-            if len(tbf) == 0:
-                return 0
-            else:
-                return 2
+        elif move in self.legal[-self.next_hand_color]:
+            return 2
+        else:
+            return 0
         
     def get_valid_moves(self, ):
-        regular_moves = []
-        forfeit_moves = []
-        for move in range(64):
-            x = self.tentative_move(move)
-            if x == 1:
-                regular_moves.append(move)
-            elif x == 2:
-                forfeit_moves.append(move)
-            else:
-                pass
+        self.settle()
+        regular_moves = self.legal[self.next_hand_color]
+        forfeit_moves = self.legal[-self.next_hand_color]
         if len(regular_moves):
-            return regular_moves
+            return sorted(regular_moves)
         elif len(forfeit_moves):
-            return forfeit_moves
+            return sorted(forfeit_moves)
         else:
             return []
  
-    def get_gt(self, moves, func, prt=False):
+    def get_gt(self, moves, func, prt=False, cache=None):
         # takes a new move or new moves and update state
+        # cache: a PositionCache to memoize func in, only for features of the position (not get_age)
         container = []
         if prt:
             self.__print__()
         for _, move in enumerate(moves):
             self.umpire(move)
-            container.append(getattr(self, func)())  
+            if cache is None:
+                container.append(getattr(self, func)())
+            else:
+                container.append(self.cached(func, cache=cache))
             # to predict first y, we need already know the first x
             if prt:
                 self.__print__()
         return container
 
+    def get_gt_multi(self, moves, features=gt_features):
+        # like get_gt for several features at once, replaying the moves a single time
+        # returns {feature: array} with one row per move: [T, 64] for state (white 0, blank 1, black 2),
+        # age, occupied, legal (get_valid_moves as a mask) and flipped (squares the move flipped),
+        # [T, ] for next_hand_color (as get_next_hand_color)
+        T = len(moves)
+        tbr = {f: np.zeros((T, ) if f == "next_hand_color" else (T, 64), dtype=gt_dtypes[f]) for f in features}
+        need_board = "state" in tbr or "occupied" in tbr
+        for t, move in enumerate(moves):
+            flips = self.umpire(move)
+            if need_board:
+                board = self.state.reshape(-1)
+            if "state" in tbr:
+                tbr["state"][t] = board + 1
+            if "age" in tbr:
+                tbr["age"][t] = self.age.reshape(-1)
+            if "occupied" in tbr:
+                tbr["occupied"][t] = board != 0
+            if "legal" in tbr:
+                tbr["legal"][t, self.get_valid_moves()] = True
+            if "flipped" in tbr:
+                tbr["flipped"][t, flips] = True
+            if "next_hand_color" in tbr:
+                tbr["next_hand_color"][t] = self.get_next_hand_color()
+        return tbr
+
+# Bitboard engine: the board is two 64-bit ints (one per color), bit i is square i in the
+# same row-major indexing as permit(), so a1 is bit 0 and h8 is bit 63
+full_board = (1 << 64) - 1
+not_col_0 = full_board & ~sum(1 << (r * 8) for r in range(8))
+not_col_7 = full_board & ~sum(1 << (r * 8 + 7) for r in range(8))
+# for every direction in eights, how far a bit moves and what to mask after moving to stop row wrap-around
+bb_directions = [(dr * 8 + dc, {-1: not_col_7, 0: full_board, 1: not_col_0}[dc]) for dr, dc in eights]
+
+def bb_shift(x, delta, guard):
+    if delta > 0:
+        return (x << delta) & guard
+    return (x >> -delta) & guard
+
+def bb_moves(own, opp):
+    # all squares where own can drop a piece and flip at least one of opp's
+    empty = ~(own | opp) & full_board
+    moves = 0
+    for delta, guard in bb_directions:
+        opp_guarded = opp & guard  # bb_shift inlined, this is the hot loop of every search
+        if delta > 0:
+            x = (own << delta) & opp_guarded
+            for _ in range(5):  # a run of opp pieces is at most 6 long
+                x |= (x << delta) & opp_guarded
+            moves |= (x << delta) & guard & empty
+        else:
+            x = (own >> -delta) & opp_guarded
+            for _ in range(5):
+                x |= (x >> -delta) & opp_guarded
+            moves |= (x >> -delta) & guard & empty
+    return moves
+
+# ray_bits[move]: the rays of move as tuples of single-bit masks, for bb_flips
+ray_bits = tuple(tuple(tuple(1 << sq for sq in ray) for ray in move_rays if len(ray) > 1) for move_rays in rays)
+
+def bb_flips(own, opp, move):
+    # pieces of opp that get flipped if own drops a piece at move, 0 if none
+    flips = 0
+    for ray in ray_bits[move]:
+        buffer = 0
+        for x in ray:
+            if x & opp:
+                buffer |= x
+            else:
+                if x & own:
+                    flips |= buffer
+                break
+    return flips
+
+def bb_to_squares(x):
+    # indices of set bits, ascending
+    tbr = []
+    while x:
+        low = x & -x
+        tbr.append(low.bit_length() - 1)
+        x ^= low
+    return tbr
+
+def bb_to_array(x):
+    # [64, ] uint8 0/1 array
+    return np.unpackbits(np.array([x], dtype="<u8").view(np.uint8), bitorder="little")
+
+class OthelloBitBoardState(OthelloBoardState):
+    # drop-in replacement of OthelloBoardState backed by two bitboards, every public method returns
+    # exactly what OthelloBoardState returns; self.state and self.age are materialized on access
+    def __init__(self, board_size = 8):
+        self.board_size = board_size * board_size
+        self.black = (1 << 28) | (1 << 35)
+        self.white = (1 << 27) | (1 << 36)
+        self.touched = [0] * 64  # ply at which each square was last placed or flipped
+        self.next_hand_color = 1
+        self.history = []
+        self.undo_stack = []
+        self.refresh()
+
+    @property
+    def state(self, ):
+        # a copy built from the bitboards, read-only as writing to it would change nothing, use set_square
+        tbr = (bb_to_array(self.black).astype(float) - bb_to_array(self.white)).reshape(8, 8)
+        tbr.flags.writeable = False
+        return tbr
+
+    @state.setter
+    def state(self, board):
+        board = np.asarray(board).flatten()
+        self.black = sum(1 << i for i in np.flatnonzero(board == 1).tolist())
+        self.white = sum(1 << i for i in np.flatnonzero(board == -1).tolist())
+        self.refresh()
+
+    def refresh(self, ):
+        self.zobrist = 0
+        for sq in bb_to_squares(self.black):
+            self.zobrist ^= zobrist_keys[1][sq]
+        for sq in bb_to_squares(self.white):
+            self.zobrist ^= zobrist_keys[-1][sq]
+
+    @property
+    def age(self, ):
+        ply = len(self.history)
+        return np.array([ply - t for t in self.touched], dtype=float).reshape(8, 8)
+
+    def canonical_position_key(self, ):
+        cells = [0] * 64
+        for sq in bb_to_squares(self.black):
+            cells[sq] = 1
+        for sq in bb_to_squares(self.white):
+            cells[sq] = -1
+        return canonical_zobrist(cells, self.next_hand_color)
+
+    def sync(self, ):
+        pass  # self.state is a read-only copy here, the bitboards can not change behind umpire's back
+
+    def sides(self, color):
+        # (own, opp) bitboards of color
+        return (self.black, self.white) if color == 1 else (self.white, self.black)
+
+    def get_occupied(self, ):
+        return bb_to_array(self.black | self.white).astype(bool).tolist()
+    def get_state(self, ):
+        board = 1. + bb_to_array(self.black) - bb_to_array(self.white).astype(float)  # white 0, blank 1, black 2
+        return board.tolist()
+    def get_age(self, ):
+        ply = len(self.history)
+        return [float(ply - t) for t in self.touched]
+
+    def umpire(self, move, undo=False):
+        r, c = move // 8, move % 8
+        assert not (self.black | self.white) >> move & 1, f"{r}-{c} is already occupied!"
+        prev_hand_color = color = self.next_hand_color
+        own, opp = self.sides(color)
+        tbf = bb_flips(own, opp, move)
+        if tbf == 0:  # means one hand is forfeited
+            color *= -1
+            tbf = bb_flips(opp, own, move)
+        if tbf == 0:
+            valids = self.get_valid_moves()
+            if len(valids) == 0:
+                assert 0, "Both color cannot put piece, game should have ended!"
+            else:
+                assert 0, "Illegal move!"
+
+        placed = tbf | (1 << move)
+        if undo:
+            self.undo_stack.append((self.black, self.white, prev_hand_color, self.zobrist,
+                                    [(sq, self.touched[sq]) for sq in bb_to_squares(placed)]))
+        if color == 1:
+            self.black |= placed
+            self.white &= ~tbf
+        else:
+            self.white |= placed
+            self.black &= ~tbf
+        self.history.append(move)
+        ply = len(self.history)
+        zobrist = self.zobrist
+        for sq in bb_to_squares(placed):
+            self.touched[sq] = ply
+            zobrist ^= zobrist_keys[color][sq]
+            if sq != move:
+                zobrist ^= zobrist_keys[-color][sq]
+        self.zobrist = zobrist
+        self.next_hand_color = -color
+        return bb_to_squares(tbf)
+
+    def unmake_move(self, ):
+        self.black, self.white, self.next_hand_color, self.zobrist, touched = self.undo_stack.pop()
+        for sq, t in touched:
+            self.touched[sq] = t
+        self.history.pop()
+
+    def restore(self, snapshot):
+        self.next_hand_color = snapshot.next_hand_color
+        self.history = list(snapshot.history)
+        self.touched = [len(self.history) - int(_) for _ in snapshot.age]
+        self.undo_stack = []
+        self.state = snapshot.cells
+
+    def clone(self, ):
+        tbr = copy(self)
+        tbr.touched = self.touched[:]
+        tbr.history = self.history[:]
+        tbr.undo_stack = []
+        return tbr
+
+    def tentative_move(self, move):
+        # same return codes as OthelloBoardState.tentative_move
+        if (self.black | self.white) >> move & 1:
+            return 0
+        own, opp = self.sides(self.next_hand_color)
+        if bb_flips(own, opp, move):
+            return 1
+        if bb_flips(opp, own, move):
+            return 2
+        return 0
+
+    def get_valid_moves(self, ):
+        own, opp = self.sides(self.next_hand_color)
+        moves = bb_moves(own, opp)
+        if moves == 0:  # forfeit, the opponent moves instead
+            moves = bb_moves(opp, own)
+        return bb_to_squares(moves)
+
+# the same shift-and-mask move generation on [N, ] uint64 arrays, one bitboard per game
+bb_directions_np = [(np.uint64(abs(delta)), delta > 0, np.uint64(guard)) for delta, guard in bb_directions]
+
+def bb_shift_np(x, amount, left, guard):
+    if left:
+        return (x << amount) & guard
+    return (x >> amount) & guard
+
+def bb_moves_np(own, opp):
+    empty = ~(own | opp)
+    moves = np.zeros_like(own)
+    for direction in bb_directions_np:
+        x = bb_shift_np(own, *direction) & opp
+        for _ in range(5):
+            x |= bb_shift_np(x, *direction) & opp
+        moves |= bb_shift_np(x, *direction) & empty
+    return moves
+
+def bb_flips_np(own, opp, moves_bb):
+    # moves_bb: [N, ] uint64 with (at most) one bit set per game
+    flips = np.zeros_like(own)
+    for direction in bb_directions_np:
+        x = bb_shift_np(moves_bb, *direction) & opp
+        for _ in range(5):
+            x |= bb_shift_np(x, *direction) & opp
+        # the run of opp pieces only counts if it is capped by an own piece
+        flips |= np.where(bb_shift_np(x, *direction) & own, x, np.uint64(0))
+    return flips
+
+def bb_to_array_np(x):
+    # [N, ] uint64 -> [N, 64] bool
+    x = np.ascontiguousarray(x, dtype="<u8")
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little").astype(bool)
+
+def squares_to_bb_np(moves):
+    # [N, ] square indices -> [N, ] uint64, negative entries (padding) give an empty bitboard
+    moves = np.asarray(moves, dtype=np.int64)
+    tbr = np.left_shift(np.uint64(1), np.clip(moves, 0, 63).astype(np.uint64))
+    return np.where(moves >= 0, tbr, np.uint64(0))
+
+class BatchedOthelloBoards():
+    # N games stepped in lockstep, one move per game per step()
+    # a negative move (e.g. the -100 padding of CharDataset) or move_pad leaves that game untouched
+    # arrays follow the getters of OthelloBoardState: state is white 0, blank 1, black 2,
+    # next player is 1 for black and 0 for white, legal is what get_valid_moves would return
+    def __init__(self, n):
+        self.n = n
+        self.black = np.full(n, (1 << 28) | (1 << 35), dtype=np.uint64)
+        self.white = np.full(n, (1 << 27) | (1 << 36), dtype=np.uint64)
+        self.next_hand_color = np.ones(n, dtype=np.int8)  # 1 is black, -1 is white
+        self.ply = np.zeros(n, dtype=np.int16)
+        self.touched = np.zeros((n, 64), dtype=np.int16)  # ply at which each square was last placed or flipped
+
+    def sides(self, ):
+        is_black = self.next_hand_color == 1
+        return np.where(is_black, self.black, self.white), np.where(is_black, self.white, self.black)
+
+    def get_legal_bb(self, ):
+        own, opp = self.sides()
+        moves = bb_moves_np(own, opp)
+        # forfeit: if the player to move has nothing, the opponent's moves are the valid ones
+        return np.where(moves != 0, moves, bb_moves_np(opp, own))
+
+    def get_legal(self, ):
+        return bb_to_array_np(self.get_legal_bb())
+    def get_state(self, ):
+        return (1 + bb_to_array_np(self.black).astype(np.int8) - bb_to_array_np(self.white)).astype(np.int8)
+    def get_age(self, ):
+        return self.ply[:, None] - self.touched
+    def get_occupied(self, ):
+        return bb_to_array_np(self.black | self.white)
+    def get_next_hand_color(self, ):
+        return ((self.next_hand_color + 1) // 2).astype(np.int8)
+
+    def step(self, moves, strict=True):
+        # moves: [N, ] board squares, one per game
+        # returns (legal [N, 64], flipped [N, 64], state [N, 64], age [N, 64], next player [N, ]) after the move
+        # an illegal move asserts like umpire does when strict, else that game is left untouched
+        # and reported in self.illegal
+        flips = self.play(moves, strict=strict)
+        return self.get_legal(), bb_to_array_np(flips), self.get_state(), self.get_age(), self.get_next_hand_color()
+
+    def play(self, moves, strict=True):
+        # step() without building the output arrays, returns the [N, ] flipped bitboards
+        moves = np.asarray(moves, dtype=np.int64)
+        assert moves.shape == (self.n, ), f"expected {self.n} moves, got {moves.shape}"
+        active = (moves >= 0) & (moves != move_pad)
+        move_bb = squares_to_bb_np(moves)
+        own, opp = self.sides()
+        occupied = (self.black | self.white) & move_bb
+        flips = bb_flips_np(own, opp, move_bb)
+        forfeit = flips == 0  # the player to move cannot flip anything here, so the opponent plays it
+        flips = np.where(forfeit, bb_flips_np(opp, own, move_bb), flips)
+        self.illegal = active & ((moves > 63) | (occupied != 0) | (flips == 0))
+        if strict:
+            assert not self.illegal.any(), f"Illegal move in games {np.flatnonzero(self.illegal).tolist()}!"
+        play = active & ~self.illegal
+        flips = np.where(play, flips, np.uint64(0))
+        placed = np.where(play, flips | move_bb, np.uint64(0))
+        color = np.where(forfeit, -self.next_hand_color, self.next_hand_color)
+        is_black = color == 1
+        self.black = np.where(is_black, self.black | placed, self.black & ~flips)
+        self.white = np.where(is_black, self.white & ~flips, self.white | placed)
+        self.ply = self.ply + play
+        self.touched = np.where(bb_to_array_np(placed), self.ply[:, None], self.touched)
+        self.next_hand_color = np.where(play, -color, self.next_hand_color).astype(np.int8)
+        return flips
+
+    def replay(self, moves, strict=True):
+        # moves: [N, T], padded with negative numbers or move_pad; returns the outputs of step() stacked to [N, T, ...]
+        moves = np.asarray(moves)
+        outs = [self.step(moves[:, t], strict=strict) for t in range(moves.shape[1])]
+        return tuple(np.stack(_, axis=1) for _ in zip(*outs))
+
+def popcount_np(x):
+    # [N, ] uint64 -> [N, ] number of set bits
+    x = np.ascontiguousarray(x, dtype="<u8")
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(1)
+
+# how generate_random_games weighs the legal moves of a position, given the flipped counts and the
+# number of replies left to the opponent after each of them (both [P, ], one entry per legal move)
+playout_policies = {
+    "uniform": lambda flips, replies: np.ones(len(flips)),
+    "greedy": lambda flips, replies: flips.astype(float),  # replaced by the argmax below, ties at random
+    "mobility": lambda flips, replies: 1. / (1. + replies),  # fewer replies for the opponent, likelier
+}
+
+def generate_random_games(n, seed=None, policy="uniform", chunk_size=100000):
+    # n random legal games played in lockstep on bitboards, every ply draws one move per game from the
+    # weights of policy (a key of playout_policies) in a single vectorized step; forfeits as in umpire
+    # returns [n, 60] uint8 moves padded with move_pad, reproducible for a given seed and chunk_size
+    assert policy in playout_policies, f"policy should be one of {list(playout_policies)}"
+    rng = np.random.default_rng(seed)
+    tbr = np.full((n, 60), move_pad, dtype=np.uint8)
+    for start in range(0, n, chunk_size):
+        m = min(chunk_size, n - start)
+        boards = BatchedOthelloBoards(m)
+        for t in range(60):
+            own, opp = boards.sides()
+            legal_bb = bb_moves_np(own, opp)
+            forfeit = legal_bb == 0
+            own, opp = np.where(forfeit, opp, own), np.where(forfeit, own, opp)
+            legal_bb = np.where(forfeit, bb_moves_np(own, opp), legal_bb)
+            g, sq = np.nonzero(bb_to_array_np(legal_bb))  # one entry per (game, legal move), grouped by game
+            if len(g) == 0:
+                break
+            if policy == "uniform":
+                weights = np.ones(len(g))
+            else:
+                move_bb = np.left_shift(np.uint64(1), sq.astype(np.uint64))
+                flips = bb_flips_np(own[g], opp[g], move_bb)
+                replies = popcount_np(bb_moves_np(opp[g] & ~flips, own[g] | flips | move_bb))
+                weights = playout_policies[policy](popcount_np(flips), replies)
+                if policy == "greedy":
+                    best = np.zeros(m)
+                    np.maximum.at(best, g, weights)
+                    weights = (weights == best[g]).astype(float)
+            # weighted draw within each game's group: a uniform point on the group's stretch of the cumsum
+            cumsum = np.cumsum(weights)
+            games, first, counts = np.unique(g, return_index=True, return_counts=True)
+            before = np.where(first > 0, cumsum[first - 1], 0.)
+            point = before + rng.random(len(games)) * (cumsum[first + counts - 1] - before)
+            picked = np.minimum(np.searchsorted(cumsum, point, side="right"), first + counts - 1)
+            moves = np.full(m, -1, dtype=np.int64)
+            moves[games] = sq[picked]
+            boards.play(moves, strict=False)
+            tbr[start + games, t] = sq[picked]
+    return tbr
+
+def validate_games(moves, chunk_size=100000):
+    # bulk legality check, e.g. of games sampled from the GPT; never raises
+    # moves: [N, T] board squares, negative entries and move_pad are padding (the game stopped there)
+    # returns (first_illegal [N, ], the index of the first illegal move of every game or -1,
+    #          illegal_per_ply [T, ], how many games made their first illegal move at each ply)
+    # a move on an occupied or off-board square, one that flips nothing for either color and any move
+    # after the game is over are illegal, games are not checked past their first illegal move
+    moves = np.asarray(moves, dtype=np.int64)
+    N, T = moves.shape
+    first_illegal = np.full(N, -1, dtype=np.int64)
+    for start in range(0, N, chunk_size):
+        chunk = moves[start:start + chunk_size]
+        found = first_illegal[start:start + chunk_size]
+        boards = BatchedOthelloBoards(len(chunk))
+        for t in range(T):
+            boards.play(np.where(found >= 0, -1, chunk[:, t]), strict=False)
+            found[boards.illegal] = t
+    illegal_per_ply = np.bincount(first_illegal[first_illegal >= 0], minlength=T)
+    return first_illegal, illegal_per_ply
+
+# Board symmetries: the 8 symmetries of the square as permutations of the 64 squares, symmetry_perms[k][sq]
+# is where sq lands under transform k. Only 4 of them (identity, 180 degree rotation and the two diagonal
+# mirrors) map the starting position onto itself, the other 4 swap its colors, so only those 4 map a
+# legal game onto a legal game and are used to canonicalize
+symmetry_maps = [
+    lambda r, c: (r, c),  # identity
+    lambda r, c: (c, 7 - r),  # rotate 90
+    lambda r, c: (7 - r, 7 - c),  # rotate 180
+    lambda r, c: (7 - c, r),  # rotate 270
+    lambda r, c: (7 - r, c),  # mirror rows
+    lambda r, c: (r, 7 - c),  # mirror columns
+    lambda r, c: (c, r),  # transpose
+    lambda r, c: (7 - c, 7 - r),  # anti-transpose
+]
+symmetry_perms = np.array([[r * 8 + c for r, c in (f(sq // 8, sq % 8) for sq in range(64))] for f in symmetry_maps])
+symmetry_inverse = np.array([[k2 for k2 in range(8) if (symmetry_perms[k2][symmetry_perms[k]] == np.arange(64)).all()][0]
+                             for k in range(8)])
+start_cells = OthelloBoardState().cells
+start_symmetries = [k for k in range(8) if all(start_cells[symmetry_perms[k][sq]] == start_cells[sq] for sq in range(64))]
+
+def transform_moves(moves, sym):
+    # moves: [N, T] board squares padded with negative numbers or move_pad, which are left as they are,
+    # sym: one symmetry index or [N, ] of them
+    moves = np.asarray(moves)
+    sym = np.broadcast_to(np.asarray(sym), moves.shape[:1])
+    pad = (moves < 0) | (moves == move_pad)
+    tbr = symmetry_perms[sym[:, None], np.where(pad, 0, moves)]
+    return np.where(pad, moves, tbr).astype(moves.dtype)
+
+def transform_boards(boards, sym):
+    # boards: [N, 64] or [N, 8, 8] per-square values (any encoding), sym: one symmetry index or [N, ] of them
+    boards = np.asarray(boards)
+    flat = boards.reshape(len(boards), 64)
+    sym = np.broadcast_to(np.asarray(sym), flat.shape[:1])
+    tbr = np.empty_like(flat)
+    # the value at sq moves to perms[sq]
+    tbr[np.arange(len(flat))[:, None], symmetry_perms[sym]] = flat
+    return tbr.reshape(boards.shape)
+
+def lexmin_images(images):
+    # images: [K, N, L], returns [N, ] index of the lexicographically smallest of the K rows of every n
+    K, N, L = images.shape
+    tied = np.ones((N, K), dtype=bool)
+    for col in range(L):
+        vals = np.where(tied, images[:, :, col].T, np.iinfo(np.int64).max)
+        tied &= vals == vals.min(axis=1, keepdims=True)
+        if (tied.sum(axis=1) == 1).all():
+            break
+    return tied.argmax(axis=1)
+
+def canonicalize_moves(moves):
+    # move sequences -> (canonical sequences, symmetry index applied to each), canonical being the
+    # lexicographically smallest image under start_symmetries; the 4 possible first moves are one orbit,
+    # so in practice the canonical game is the one opening at 19 (c4)
+    moves = np.asarray(moves)
+    images = np.stack([transform_moves(moves, k) for k in start_symmetries])
+    sym = np.array(start_symmetries)[lexmin_images(images)]
+    return transform_moves(moves, sym), sym
+
+def canonicalize_boards(boards):
+    # same as canonicalize_moves for boards, [N, 64] or [N, 8, 8]
+    boards = np.asarray(boards)
+    images = np.stack([transform_boards(boards, k).reshape(len(boards), 64) for k in start_symmetries])
+    sym = np.array(start_symmetries)[lexmin_images(images.astype(np.int64))]
+    return transform_boards(boards, sym), sym
+
+def uncanonicalize_moves(moves, sym):
+    # inverse of canonicalize_moves given the symmetry indices it returned
+    return transform_moves(moves, symmetry_inverse[np.asarray(sym)])
+
+def uncanonicalize_boards(boards, sym):
+    return transform_boards(boards, symmetry_inverse[np.asarray(sym)])
+
 if __name__ == "__main__":
     pass
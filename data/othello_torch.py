@@ -0,0 +1,102 @@
+import numpy as np
+import torch
+
+from .othello import eights, rays, move_pad
+
+# Othello board replay written in torch ops only, so ground-truth labels can be computed on the
+# same device as the model activations without a host round-trip or a Python loop over games.
+# Squares use the same 0-63 indexing as permit(); index 64 is an always-empty sentinel square
+# that rays point to once they leave the board.
+
+def build_rays():
+    # [64, 8, 7], the ray table of othello.py padded with the sentinel square
+    tbr = np.full((64, 8, 7), 64, dtype=np.int64)
+    for move, move_rays in enumerate(rays):
+        for d, ray in enumerate(move_rays):
+            tbr[move, d, :len(ray)] = ray
+    return tbr
+
+rays_np = build_rays()
+rays_cache = {}
+
+def get_rays(device):
+    if device not in rays_cache:
+        rays_cache[device] = torch.tensor(rays_np, device=device)
+    return rays_cache[device]
+
+def ray_flips(vals, color):
+    # vals: [B, ..., 8, 7] int8, board contents along rays leaving the square(s) where a piece is dropped
+    # color: [B, ] int8, the color dropping the piece
+    # returns [B, ..., 8, 7] bool, which squares along each ray get flipped
+    col = color.view(-1, *([1] * (vals.dim() - 1)))
+    run = vals == -col  # becomes the leading run of opponent pieces
+    for k in range(1, 7):
+        run[..., k] &= run[..., k - 1]
+    capped = (run[..., :-1] & (vals[..., 1:] == col)).any(-1, keepdim=True)
+    return run & capped
+
+def shift(x, dr, dc):
+    # [B, 8, 8] moved by dr rows and dc columns, what falls off the board is dropped
+    tbr = torch.zeros_like(x)
+    tbr[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = \
+        x[:, max(-dr, 0):8 + min(-dr, 0), max(-dc, 0):8 + min(-dc, 0)]
+    return tbr
+
+def capturing_moves(own, opp, empty):
+    # [B, 8, 8] bool, empty squares where own would flip at least one of opp's, the
+    # same flood fill as bb_moves in othello.py done on dense boolean boards
+    moves = torch.zeros_like(own)
+    for dr, dc in eights:
+        x = shift(own, dr, dc) & opp
+        for _ in range(5):
+            x |= shift(x, dr, dc) & opp
+        moves |= shift(x, dr, dc) & empty
+    return moves
+
+def legal_moves(board, color):
+    # [B, 64] bool, what OthelloBoardState.get_valid_moves would return for the player to move
+    B = board.shape[0]
+    state = board[:, :64].view(B, 8, 8) * color.view(B, 1, 1)  # 1 for the player to move
+    own, opp, empty = state == 1, state == -1, state == 0
+    moves = capturing_moves(own, opp, empty).view(B, 64)
+    forfeit = capturing_moves(opp, own, empty).view(B, 64)
+    return torch.where(moves.any(-1, keepdim=True), moves, forfeit)
+
+def replay_games(moves):
+    # moves: [B, T] board squares, negative entries and move_pad (padding) leave that game untouched,
+    # as do illegal moves, which are not asserted on to keep everything on device
+    # returns (state [B, T, 8, 8] int8 as in board.state, legal [B, T, 64] bool, flipped [B, T, 64] bool),
+    # each entry describing the board right after move t, forfeits handled as in umpire
+    device = moves.device
+    B, T = moves.shape
+    ray_table = get_rays(device)
+    board = torch.zeros(B, 65, dtype=torch.int8, device=device)
+    board[:, [28, 35]] = 1
+    board[:, [27, 36]] = -1
+    color = torch.ones(B, dtype=torch.int8, device=device)
+    states, legals, flips = [], [], []
+    for t in range(T):
+        move = moves[:, t].long()
+        move = torch.where(move == move_pad, torch.full_like(move, -1), move)
+        sq = move.clamp(min=0)
+        ray = ray_table[sq]  # [B, 8, 7]
+        vals = torch.gather(board, 1, ray.flatten(1)).view(B, 8, 7)
+        f_own = ray_flips(vals, color)
+        f_opp = ray_flips(vals, -color)
+        own_ok = f_own.flatten(1).any(-1)
+        opp_ok = f_opp.flatten(1).any(-1)
+        empty = torch.gather(board, 1, sq[:, None])[:, 0] == 0
+        play = (move >= 0) & empty & (own_ok | opp_ok)
+        mover = torch.where(own_ok, color, -color)  # forfeit: the opponent drops the piece
+        f = torch.where(own_ok[:, None, None], f_own, f_opp) & play[:, None, None]
+        flipped = torch.zeros(B, 65, dtype=torch.bool, device=device)
+        flipped.scatter_(1, ray.flatten(1), f.flatten(1))
+        flipped[:, 64] = False
+        placed = flipped.clone()
+        placed[torch.arange(B, device=device), sq] |= play
+        board = torch.where(placed, mover[:, None], board)
+        color = torch.where(play, -mover, color)
+        states.append(board[:, :64].view(B, 8, 8))
+        legals.append(legal_moves(board, color))
+        flips.append(flipped[:, :64])
+    return torch.stack(states, 1), torch.stack(legals, 1), torch.stack(flips, 1)
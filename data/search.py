@@ -0,0 +1,159 @@
+# Alpha-beta search on the bitboards of othello.py, as a reference opponent of tunable strength
+# for the GUI and headless arenas, and to generate stronger-than-random games
+# usage: best_move(board, budget=20000) with board any engine (OthelloBoardState, OthelloBitBoardState)
+import time
+import random
+
+from .othello import OthelloBitBoardState, bb_moves, bb_flips, bb_to_squares
+
+# classic positional weights, corners good, squares next to them bad
+square_weights = [
+    100, -20, 10, 5, 5, 10, -20, 100,
+    -20, -50, -2, -2, -2, -2, -50, -20,
+    10, -2, -1, -1, -1, -1, -2, 10,
+    5, -2, -1, -1, -1, -1, -2, 5,
+    5, -2, -1, -1, -1, -1, -2, 5,
+    10, -2, -1, -1, -1, -1, -2, 10,
+    -20, -50, -2, -2, -2, -2, -50, -20,
+    100, -20, 10, 5, 5, 10, -20, 100,
+]
+# weights_by_byte[r][b]: summed weight of the squares of row r set in byte b, to score a bitboard in 8 lookups
+weights_by_byte = [[sum(square_weights[r * 8 + i] for i in range(8) if b >> i & 1) for b in range(256)] for r in range(8)]
+win_score = 100000
+mobility_weight = 10
+exact, lower, upper = 0, 1, 2
+
+def popcount(x):
+    return bin(x).count("1")
+
+def positional(x):
+    return sum(weights_by_byte[r][x >> (r * 8) & 255] for r in range(8))
+
+def final_score(own, opp):
+    diff = popcount(own) - popcount(opp)
+    return (win_score if diff > 0 else -win_score if diff < 0 else 0) + diff
+
+def evaluate(own, opp):
+    mobility = popcount(bb_moves(own, opp)) - popcount(bb_moves(opp, own))
+    return positional(own) - positional(opp) + mobility_weight * mobility
+
+def board_to_bitboards(board):
+    # (own, opp) bitboards of the player who actually moves next, following the forfeit rule of
+    # get_valid_moves, or None if the game is over
+    if isinstance(board, OthelloBitBoardState):
+        black, white = board.black, board.white
+    else:
+        cells = board.state.flatten().tolist()
+        black = sum(1 << sq for sq, v in enumerate(cells) if v == 1)
+        white = sum(1 << sq for sq, v in enumerate(cells) if v == -1)
+    own, opp = (black, white) if board.next_hand_color == 1 else (white, black)
+    if bb_moves(own, opp) == 0:
+        own, opp = opp, own
+    if bb_moves(own, opp) == 0:
+        return None
+    return own, opp
+
+class SearchAborted(Exception):
+    pass
+
+class AlphaBetaSearcher():
+    # iterative deepening negamax with alpha-beta, a transposition table kept across calls and
+    # move ordering by the table's best move, then positional weight
+    # strength is set by the node budget (and optionally max_time in seconds and max_depth)
+    def __init__(self, max_time=None, max_depth=60, tt_size=2 ** 20):
+        self.max_time = max_time
+        self.max_depth = max_depth
+        self.tt_size = tt_size
+        self.tt = {}
+
+    def best_move(self, board, budget=20000):
+        # best square for the player to move on board within budget nodes, None if the game is over
+        sides = board_to_bitboards(board)
+        if sides is None:
+            return None
+        own, opp = sides
+        if len(self.tt) > self.tt_size:
+            self.tt = {}
+        self.nodes = 0
+        self.max_nodes = budget
+        self.deadline = None if self.max_time is None else time.time() + self.max_time
+        best = self.order(own, opp, bb_to_squares(bb_moves(own, opp)))[0]
+        self.depth_reached = 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                value = self.negamax(own, opp, depth, -2 * win_score, 2 * win_score)
+            except SearchAborted:
+                break
+            best = self.tt[(own, opp)][3]
+            self.value, self.depth_reached = value, depth
+            if abs(value) >= win_score or depth >= popcount(~(own | opp) & ((1 << 64) - 1)):
+                break  # solved to the end
+        return best
+
+    def order(self, own, opp, moves, tt_move=None):
+        moves = sorted(moves, key=lambda m: -square_weights[m])
+        if tt_move in moves:
+            moves.remove(tt_move)
+            moves.insert(0, tt_move)
+        return moves
+
+    def negamax(self, own, opp, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes > self.max_nodes:
+            raise SearchAborted
+        if self.deadline is not None and self.nodes & 255 == 0 and time.time() > self.deadline:
+            raise SearchAborted
+        key = (own, opp)
+        entry = self.tt.get(key)
+        tt_move = None
+        if entry is not None:
+            e_depth, e_value, e_flag, tt_move = entry
+            if e_depth >= depth:
+                if e_flag == exact:
+                    return e_value
+                elif e_flag == lower:
+                    alpha = max(alpha, e_value)
+                else:
+                    beta = min(beta, e_value)
+                if alpha >= beta:
+                    return e_value
+        moves = bb_moves(own, opp)
+        if moves == 0:
+            if bb_moves(opp, own) == 0:
+                return final_score(own, opp)
+            return -self.negamax(opp, own, depth, -beta, -alpha)  # forfeit, not a ply
+        if depth == 0:
+            return evaluate(own, opp)
+        alpha_start = alpha
+        best_value, best = -2 * win_score, None
+        for move in self.order(own, opp, bb_to_squares(moves), tt_move):
+            flips = bb_flips(own, opp, move)
+            value = -self.negamax(opp & ~flips, own | flips | (1 << move), depth - 1, -beta, -alpha)
+            if value > best_value:
+                best_value, best = value, move
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+        flag = upper if best_value <= alpha_start else lower if best_value >= beta else exact
+        self.tt[key] = (depth, best_value, flag, best)
+        return best_value
+
+default_searcher = AlphaBetaSearcher()
+
+def best_move(board, budget=20000):
+    return default_searcher.best_move(board, budget)
+
+def get_search_game(budget=2000, random_plies=8, seed=None):
+    # a game between two searchers of the same budget, after random_plies uniformly random
+    # opening moves so games differ; same format as get_ood_game
+    rng = random.Random(seed)
+    searcher = AlphaBetaSearcher()
+    board = OthelloBitBoardState()
+    tbr = []
+    valids = board.get_valid_moves()
+    while valids:
+        move = rng.choice(valids) if len(tbr) < random_plies else searcher.best_move(board, budget)
+        board.umpire(move)
+        tbr.append(move)
+        valids = board.get_valid_moves()
+    return tbr
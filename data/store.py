@@ -0,0 +1,29 @@
+# One-shot conversion of the pickled synthetic shards into the packed store of othello.py
+#   python -m data.store --src ./data/othello_synthetic --out ./data/othello_synthetic/packed
+# keeps the games Othello(ood_num=-1) would load from the pickles (the first max_files files by name,
+# skipping files shorter than min_games), deduplicated and sorted as load_shards does, so the
+# train/val split is the same whichever of the two Othello reads
+import os
+import time
+import argparse
+
+from .othello import write_store, wanna_use, packed_store, move_pad, read_distinct
+
+def convert_pickles(src, out, max_files=250, min_games=9e4, mem_gb=None):
+    files = sorted(f for f in os.listdir(src) if f.endswith(".pickle"))[:max_files]
+    moves = read_distinct([os.path.join(src, f) for f in files], mem_gb, min_games)  # 60 bytes per game
+    lengths = (moves != move_pad).sum(1)
+    write_store(out, moves, lengths, sources=files, created=time.strftime("%Y%m%d_%H%M%S"))
+    print(f"Wrote {len(moves)} games from {len(files)} files to {out}")
+    return len(moves)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert the pickled synthetic games into a packed store')
+    parser.add_argument('--src', default=f"./data/{wanna_use}", type=str)
+    parser.add_argument('--out', default=packed_store, type=str)
+    parser.add_argument('--max_files', default=250, type=int)
+    parser.add_argument('--min_games', default=9e4, type=float)
+    parser.add_argument('--mem_gb', default=None, type=float)
+    args = parser.parse_args()
+
+    convert_pickles(args.src, args.out, args.max_files, args.min_games, args.mem_gb)
@@ -3,6 +3,7 @@
 
 import os
 import sys
+import argparse
 
 # Aseguramos que el directorio raíz del proyecto esté en el path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,16 +13,26 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from gui.game_gui import GameGUI
 from gui.probs_plot import ProbsPlot
 from gui.model_handler import ModelHandler
+from gui.search_handler import SearchHandler
 
 if __name__ == "__main__":
+    # Elegir el oponente: el modelo Othello-GPT o la búsqueda alfa-beta
+    parser = argparse.ArgumentParser(description='Jugar Othello contra Othello-GPT o alfa-beta')
+    parser.add_argument('--oponente', default="gpt", choices=["gpt", "alfabeta"], type=str)
+    parser.add_argument('--nodos', default=20000, type=int)  # fuerza del oponente alfa-beta
+    args = parser.parse_args()
+
     # Ruta al checkpoint del modelo pre-entrenado
     checkpoint_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "ckpts", "gpt_championship.ckpt")
     
     # Inicializa la GUI del gráfico de probabilidades
     probs_plot = ProbsPlot()
     
-    # Crear el manejador del modelo
-    model_handler = ModelHandler(checkpoint_path, probs_plot)
+    # Crear el manejador del modelo (o del oponente de búsqueda)
+    if args.oponente == "alfabeta":
+        model_handler = SearchHandler(budget=args.nodos, probs_plot=probs_plot)
+    else:
+        model_handler = ModelHandler(checkpoint_path, probs_plot)
     
     # Inicializa la GUI del juego con el callback para realizar jugadas automáticas
     game_gui = GameGUI(callback=model_handler)
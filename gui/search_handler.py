@@ -0,0 +1,56 @@
+# search_handler.py
+# Oponente de búsqueda alfa-beta con la misma interfaz que ModelHandler
+
+from data.othello import OthelloBitBoardState
+from data.search import AlphaBetaSearcher
+
+class SearchHandler:
+    def __init__(self, budget=20000, max_time=None, probs_plot=None):
+        """
+        Inicializa el oponente de búsqueda alfa-beta.
+        
+        Args:
+            budget: Número máximo de nodos por jugada (controla la fuerza del oponente).
+            max_time: Tiempo máximo en segundos por jugada, None para no limitarlo.
+            probs_plot: Referencia al objeto ProbsPlot (no se usa, la búsqueda no da probabilidades).
+        """
+        self.budget = budget
+        self.searcher = AlphaBetaSearcher(max_time=max_time)
+        self.probs_plot = probs_plot
+        self.board = OthelloBitBoardState()
+    
+    def get_move_probabilities(self, move_history):
+        """
+        Reconstruye el tablero a partir del historial de jugadas.
+        
+        Args:
+            move_history: Historial de movimientos hasta ahora
+        
+        Returns:
+            Un diccionario vacío, la búsqueda no produce probabilidades.
+        """
+        self.board = OthelloBitBoardState()
+        self.board.update(move_history)
+        return {}
+    
+    def update_probabilities(self, move_history):
+        """No hay probabilidades que mostrar para este oponente."""
+        pass
+    
+    def get_best_move(self, move_probs, valid_moves):
+        """
+        Obtiene la mejor jugada según la búsqueda alfa-beta.
+        
+        Args:
+            move_probs: Ignorado, se mantiene por compatibilidad con ModelHandler.
+            valid_moves: Lista de movimientos válidos (índices 0-63).
+        
+        Returns:
+            La jugada elegida como índice numérico (0-63), o None si no hay jugadas.
+        """
+        if not valid_moves:
+            return None
+        best = self.searcher.best_move(self.board, self.budget)
+        if best not in valid_moves:
+            return valid_moves[0]
+        return best
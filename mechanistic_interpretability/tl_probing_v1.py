@@ -1,6 +1,10 @@
 import transformer_lens.utils as utils
 from transformer_lens import HookedTransformer, HookedTransformerConfig
 from mech_interp_othello_utils import OthelloBoardState
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data.othello_torch import replay_games
 import einops
 import torch
 from tqdm import tqdm
@@ -103,12 +107,11 @@ for epoch in range(num_epochs):
         indices = full_train_indices[i:i+batch_size]
         games_int = board_seqs_int[indices]
         games_str = board_seqs_string[indices]
-        state_stack = torch.stack(
-            [torch.tensor(seq_to_state_stack(games_str[i])) for i in range(batch_size)]
-        )
+        # labels are replayed on device, same as seq_to_state_stack but without the per-game loop
+        state_stack, _, _ = replay_games(games_str.cuda())
         state_stack = state_stack[:, pos_start:pos_end, :, :]
 
-        state_stack_one_hot = state_stack_to_one_hot(state_stack).cuda()
+        state_stack_one_hot = state_stack_to_one_hot(state_stack)
         with torch.inference_mode():
             _, cache = model.run_with_cache(games_int.cuda()[:, :-1], return_type=None)
             resid_post = cache["resid_post", layer][:, pos_start:pos_end]
@@ -1,15 +1,89 @@
+import os
+import json
 import itertools
+import random
+import zlib
+import collections
+import numpy as np
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, DataLoader, BatchSampler, RandomSampler, SequentialSampler, get_worker_info
+from torch.utils.data.dataloader import default_collate
+
+from data.othello import symmetry_perms, start_symmetries, PackedGames, pad_moves, move_pad, othello_chars, \
+    othello_max_len, generate_random_games, hash_games
+
+def token_lookup(stoi):
+    # [256, ] token of every byte of a uint8 move matrix, move_pad and anything else to the token of -100
+    tbr = np.full(256, stoi[-100], dtype=np.uint8)
+    for ch, i in stoi.items():
+        if ch >= 0:
+            tbr[ch] = i
+    return tbr
+
+def scan_vocab(data):
+    # (chars, max_len) found by going over every game of data, a table scan for a packed move matrix
+    games = data.sequences if hasattr(data, "sequences") else data
+    if isinstance(games, PackedGames) and getattr(data, "ood_perc", 0) == 0:
+        chars = np.unique(games.moves)
+        chars = [-100, ] + chars[chars != move_pad].tolist()
+        return chars, int(games.lengths.max()) if len(games) else 0
+    if hasattr(data, "ood_perc"):
+        ood_perc = data.ood_perc
+        data.ood_perc = 0  # shut down the randomness
+    chars = sorted(list(set(list(itertools.chain.from_iterable(data)))) + [-100, ])
+    max_len = max([len(data[_]) for _ in range(len(data))])  # should be 60 in Othello
+    if hasattr(data, "ood_perc"):
+        data.ood_perc = ood_perc  # turn on the randomness
+    return chars, max_len
+
+def gather_moves(data, indices, max_len):
+    # [B, max_len] uint8 moves of the games of data at indices, padded with move_pad, a row gather when packed
+    games = data.sequences if hasattr(data, "sequences") else data
+    if isinstance(games, PackedGames) and getattr(data, "ood_perc", 0) == 0:
+        return games.moves[indices, :max_len]
+    return pad_moves([data[i] for i in indices], max_len)
+
+def split_xy(tokens, pin=False):
+    # [B, T + 1] token matrix -> int64 (x, y) [B, T], the inputs and the next token targets
+    tokens = torch.from_numpy(tokens.astype(np.int64))
+    x, y = tokens[:, :-1].contiguous(), tokens[:, 1:].contiguous()
+    if pin:
+        x, y = x.pin_memory(), y.pin_memory()
+    return x, y
+
+def build_tokens(data, stoi, max_len):
+    # [N, max_len] uint8 token matrix of every game of data, padded with the token of -100
+    games = data.sequences if hasattr(data, "sequences") else data
+    if isinstance(games, PackedGames):  # one table lookup over the move matrix
+        return token_lookup(stoi)[games.moves[:, :max_len]]
+    tbr = np.full((len(games), max_len), stoi[-100], dtype=np.uint8)
+    for i, game in enumerate(games):
+        tbr[i, :len(game)] = [stoi[s] for s in game]
+    return tbr
 
 class CharDataset(Dataset):
-    def __init__(self, data):
-        if hasattr(data, "ood_perc"):
-            ood_perc = data.ood_perc
-            data.ood_perc = 0  # shut down the randomness
-        chars = sorted(list(set(list(itertools.chain.from_iterable(data)))) + [-100, ])
+    def __init__(self, data, augment=False, tokens=None, verify=False):
+        # augment: map every game through a random one of the 4 board symmetries that keep the
+        # starting position, which gives legal games again, on the fly
+        # tokens: path of a .npy token matrix (written from data on first use, with the vocabulary next to
+        # it); items are then uint8 views into the memory mapped matrix, which DataLoader workers share
+        # instead of each getting a pickled copy of data, and collate widens the batches to int64
+        # verify: data with a vocab (Othello, PackedGames, from the store manifest) is not scanned for its
+        # vocabulary and game length unless verify, which checks its games against the metadata
+        self.tokens = None
+        if tokens is not None and os.path.exists(tokens):
+            with open(tokens[:-len(".npy")] + "_vocab.json") as f:
+                vocab = json.load(f)
+            chars, max_len = vocab["chars"], vocab["max_len"]
+        elif getattr(data, "vocab", None) is not None:
+            chars, max_len = data.vocab["chars"], data.vocab["max_len"]
+            if verify:
+                found, longest = scan_vocab(data)
+                assert set(found) <= set(chars), f"moves {sorted(set(found) - set(chars))} are not in the vocabulary"
+                assert longest <= max_len, f"a game of {longest} moves is longer than max_len {max_len}"
+        else:
+            chars, max_len = scan_vocab(data)
         data_size, vocab_size = len(data), len(chars)  # vocab size 61, with -100 sorted to the front
-        max_len = max([len(data[_]) for _ in range(len(data))])  # should be 60 in Othello
         print('Dataset created has %d sequences, %d unique words.' % (data_size, vocab_size))
         
         self.stoi = {ch: i for i, ch in enumerate(chars)}
@@ -17,18 +91,71 @@ class CharDataset(Dataset):
         self.max_len = max_len
         self.block_size = max_len - 1  # for autoregressive training
         self.vocab_size = vocab_size
-        if hasattr(data, "ood_perc"):
-            data.ood_perc = ood_perc  # turn on the randomness
         self.data = data
+        self.augment = augment
+        self.symmetries = [symmetry_perms[k].tolist() for k in start_symmetries]
+        if tokens is not None:
+            # the games are fixed once tokenized, no ood swapping
+            assert getattr(data, "ood_perc", 0) == 0, "ood_perc should be 0 with a token matrix"
+            if not os.path.exists(tokens):
+                np.save(tokens, build_tokens(data, self.stoi, max_len))
+                with open(tokens[:-len(".npy")] + "_vocab.json", "w") as f:
+                    json.dump({"chars": chars, "max_len": max_len, "num_games": data_size}, f)
+            self.tokens = np.load(tokens, mmap_mode="c")  # copy on write, so views are writable but pages shared
+            assert self.tokens.shape == (data_size, max_len), f"{tokens} does not match the {data_size} games of data"
+            self.data = None  # not shipped to the workers
+            # the symmetries in token space, the padding token maps to itself
+            self.token_perms = [np.array([self.stoi[perm[ch]] if ch >= 0 else i for i, ch in enumerate(chars)],
+                                         dtype=np.uint8) for perm in self.symmetries]
+        # for get_batch: the symmetries on uint8 move matrices (move_pad stays) and the move to token table
+        self.move_perms = np.array([perm + list(range(64, 256)) for perm in self.symmetries], dtype=np.uint8)
+        self.lookup = token_lookup(self.stoi)
     
     def __len__(self):
-        return len(self.data)
+        return len(self.data) if self.tokens is None else len(self.tokens)
+
+    def get_batch(self, indices, pin=False):
+        # (x, y) int64 [B, block_size] of the games at indices in one step: a gather of the rows, a
+        # symmetry per row when augmenting, then np.take through the token table, optionally pinned
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.tokens is not None:
+            tokens = np.take(self.tokens, indices, axis=0)
+            if self.augment:
+                perms = np.stack(self.token_perms)
+                tokens = perms[np.random.randint(len(perms), size=len(indices))[:, None], tokens]
+        else:
+            moves = gather_moves(self.data, indices, self.max_len)
+            if self.augment:
+                moves = self.move_perms[np.random.randint(len(self.move_perms), size=len(indices))[:, None], moves]
+            tokens = np.take(self.lookup, moves)
+        return split_xy(tokens, pin)
+
+    def batch_loader(self, batch_size, shuffle=True, num_workers=0, pin_memory=False, drop_last=False):
+        # DataLoader whose sampler hands whole index batches to get_batch, no per sample work or collate
+        sampler = BatchSampler(RandomSampler(self) if shuffle else SequentialSampler(self), batch_size, drop_last)
+        return DataLoader(self, sampler=sampler, batch_size=None, num_workers=num_workers, pin_memory=pin_memory)
+
+    @staticmethod
+    def collate(batch):
+        # default collate with the tokens widened to int64 for the embedding and the loss
+        x, y = default_collate(batch)
+        return x.long(), y.long()
 
     def __getitem__(self, idx):
+        if isinstance(idx, (list, np.ndarray)):  # a batch from batch_loader
+            return self.get_batch(idx)
+        if self.tokens is not None:
+            row = self.tokens[idx]
+            if self.augment:
+                row = random.choice(self.token_perms)[row]
+            return torch.from_numpy(row[:-1]), torch.from_numpy(row[1:])
         # grab a chunk of (block_size + 1) characters from the data
         chunk = self.data[idx]
+        if self.augment:
+            perm = random.choice(self.symmetries)
+            chunk = [perm[s] if s >= 0 else s for s in chunk]
         if len(chunk) != self.max_len:
-            chunk += [-100, ] * (self.max_len - len(chunk))  # -100 can be ignored in CE
+            chunk = chunk + [-100, ] * (self.max_len - len(chunk))  # -100 can be ignored in CE, data is left as is
         # encode every character to an integer
         dix = [self.stoi[s] for s in chunk]
         """
@@ -66,4 +193,81 @@ class CharDataset(Dataset):
         """
         x = torch.tensor(dix[:-1], dtype=torch.long)
         y = torch.tensor(dix[1:], dtype=torch.long)
-        return x, y
\ No newline at end of file
+        return x, y
+
+
+class StreamingDataset(IterableDataset):
+    # endless (x, y) batches of fresh random legal games, in place of the pickled synthetic corpus: every
+    # DataLoader worker plays its games with generate_random_games from its own seeds, derived from
+    # (seed, split, epoch, worker, batch), so a run is reproducible for a given number of workers
+    # split: salts the seeds, so e.g. the train and test streams of one seed are different games
+    # corpus: optional fixed games (Othello, PackedGames, list of games) to mix in, each row of a batch being
+    # a fresh game with probability ood_perc and a random corpus game otherwise, like Othello.__getitem__
+    # dedup_window: a worker drops fresh games equal to one of the last dedup_window it yielded (0 keeps all)
+    # batches_per_epoch: the length of an epoch for the trainer, the stream itself never ends
+    def __init__(self, batches_per_epoch, seed=0, corpus=None, ood_perc=1., dedup_window=0, policy="uniform",
+                 split="train"):
+        assert corpus is not None or ood_perc == 1, "ood_perc below 1 needs a corpus to mix in"
+        vocab = getattr(corpus, "vocab", None) or {"chars": othello_chars, "max_len": othello_max_len}
+        assert vocab["chars"] == othello_chars, "the corpus should use the Othello vocabulary of the fresh games"
+        self.stoi = {ch: i for i, ch in enumerate(othello_chars)}
+        self.itos = {i: ch for i, ch in enumerate(othello_chars)}
+        self.max_len = othello_max_len
+        self.block_size = othello_max_len - 1
+        self.vocab_size = len(othello_chars)
+        self.lookup = token_lookup(self.stoi)
+        self.batches_per_epoch = batches_per_epoch
+        self.seed = seed
+        self.split = split
+        self.corpus = corpus
+        self.ood_perc = ood_perc
+        self.dedup_window = dedup_window
+        self.policy = policy
+        self.batch_size = 64
+        self.epoch = 0
+        print('Streaming %d batches per epoch of fresh games, %d unique words.' % (batches_per_epoch, self.vocab_size))
+
+    def __len__(self):
+        return self.batches_per_epoch
+
+    def batch_loader(self, batch_size, shuffle=True, num_workers=0, pin_memory=False, drop_last=False):
+        # the batches come out of the workers whole, shuffle and drop_last have nothing to act on
+        self.batch_size = batch_size
+        self.epoch += 1  # fresh seeds every epoch, the workers get a copy of self when the loader is iterated
+        return DataLoader(self, batch_size=None, num_workers=num_workers, pin_memory=pin_memory)
+
+    def fresh_games(self, n, seeds, seen):
+        # [n, 60] uint8 fresh games, without the ones seen lately when deduplicating
+        if not self.dedup_window:
+            return generate_random_games(n, seed=next(seeds), policy=self.policy)
+        blocks, found = [np.zeros((0, self.max_len), dtype=np.uint8)], 0  # n may be 0 when mixing
+        while found < n:
+            moves = generate_random_games(n - found, seed=next(seeds), policy=self.policy)
+            keep = np.zeros(len(moves), dtype=bool)
+            for i, key in enumerate(hash_games(moves).tolist()):
+                if key in seen:
+                    continue
+                seen[key] = None
+                keep[i] = True
+                if len(seen) > self.dedup_window:
+                    seen.popitem(last=False)
+            blocks.append(moves[keep])
+            found += int(keep.sum())
+        return np.concatenate(blocks)
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        steps = self.batches_per_epoch // num_workers + (worker < self.batches_per_epoch % num_workers)
+        seeds = (int(np.random.SeedSequence([self.seed, zlib.crc32(self.split.encode()), self.epoch, worker, k]).generate_state(1, np.uint64)[0])
+                 for k in itertools.count())
+        rng = np.random.default_rng(next(seeds))  # for the mixing
+        seen = collections.OrderedDict()  # hashes of the last fresh games, oldest first
+        for _ in range(steps):
+            moves = np.empty((self.batch_size, self.max_len), dtype=np.uint8)
+            fresh = rng.random(self.batch_size) < self.ood_perc if self.corpus is not None else np.ones(self.batch_size, dtype=bool)
+            moves[fresh] = self.fresh_games(int(fresh.sum()), seeds, seen)
+            if not fresh.all():
+                indices = np.sort(rng.integers(len(self.corpus), size=int((~fresh).sum())))
+                moves[~fresh] = gather_moves(self.corpus, indices, self.max_len)
+            yield split_xy(np.take(self.lookup, moves))
@@ -64,9 +64,14 @@ class Trainer:
             is_train = split == 'train'
             model.train(is_train)
             data = self.train_dataset if is_train else self.test_dataset
-            loader = DataLoader(data, shuffle=True, pin_memory=True,
-                                batch_size=config.batch_size,
-                                num_workers=config.num_workers)
+            if hasattr(data, "batch_loader"):  # whole batches tokenized at once
+                loader = data.batch_loader(config.batch_size, shuffle=True, num_workers=config.num_workers,
+                                           pin_memory=True)
+            else:
+                loader = DataLoader(data, shuffle=True, pin_memory=True,
+                                    batch_size=config.batch_size,
+                                    num_workers=config.num_workers,
+                                    collate_fn=getattr(data, "collate", None))
 
             losses = []
             pbar = tqdm(enumerate(loader), total=len(loader)) if is_train else enumerate(loader)
@@ -22,7 +22,8 @@ from torch.nn import functional as F
 from torch.utils.data import Dataset
 from torch.utils.data.dataloader import DataLoader
 from data import get_othello
-from data.othello import permit, start_hands, OthelloBoardState
+from data.othello import permit, start_hands, pad_moves
+from data.features import extract_features, per_square, feature_classes
 from mingpt.dataset import CharDataset
 from mingpt.model import GPT, GPTConfig, GPTforProbing
 from mingpt.probe_trainer import Trainer, TrainerConfig
@@ -56,9 +57,10 @@ parser.add_argument('--championship',
 
 parser.add_argument('--exp',
                     default="state", 
-                    type=str)
+                    type=str)  # any per square feature of data/features.py
 
 args, _ = parser.parse_known_args()
+assert args.exp in per_square, f"--exp should be one of {sorted(per_square)}"
 
 folder_name = f"battery_othello/{args.exp}"
 
@@ -86,28 +88,21 @@ if torch.cuda.is_available():
     device = torch.cuda.current_device()
     model = model.to(device)
 
-loader = DataLoader(train_dataset, shuffle=False, pin_memory=True, batch_size=1, num_workers=1)
+loader = DataLoader(train_dataset, shuffle=False, pin_memory=True, batch_size=1, num_workers=1, collate_fn=train_dataset.collate)
+# targets of every game in one batched replay, the loader goes through the games in order
+gt = extract_features(pad_moves(othello.sequences), [args.exp, "age"])  # each [N, 60, 64]
 act_container = []
 property_container = []
-for x, y in tqdm(loader, total=len(loader)):
+age_container = []
+for i, (x, y) in enumerate(tqdm(loader, total=len(loader))):
     tbf = [train_dataset.itos[_] for _ in x.tolist()[0]]
     valid_until = tbf.index(-100) if -100 in tbf else 999
-    a = OthelloBoardState()
-    properties = a.get_gt(tbf[:valid_until], "get_" + args.exp)  # [block_size, ]
     act = model(x.to(device))[0, ...].detach().cpu()  # [block_size, f]
     act_container.extend([_[0] for _ in act.split(1, dim=0)[:valid_until]])
-    property_container.extend(properties)
-    
-age_container = []
-for x, y in tqdm(loader, total=len(loader)):
-    tbf = [train_dataset.itos[_] for _ in x.tolist()[0]]
-    valid_until = tbf.index(-100) if -100 in tbf else 999
-    a = OthelloBoardState()
-    ages = a.get_gt(tbf[:valid_until], "get_age")  # [block_size, ]
-    age_container.extend(ages)
+    property_container.extend(gt[args.exp][i, :min(valid_until, train_dataset.block_size)])
+    age_container.extend(gt["age"][i, :min(valid_until, train_dataset.block_size)])
 
-if args.exp == "state":
-    probe_class=3
+probe_class = feature_classes[args.exp]
 
 if args.twolayer:
     probe = BatteryProbeClassificationTwoLayer(device, probe_class=probe_class, num_task=64, mid_dim=args.mid_dim)